@@ -1,108 +1,396 @@
 import os
+import ast
+import json
+import threading
+import openai
+from datetime import datetime, timezone
 from config import Config
 from flask_cors import CORS
-from connectors.email_monitor import EmailMonitor
-from openai_llm import generate_1st_cold_email_content
-from flask import Flask, render_template, jsonify, request
+from connectors.email_monitor import EmailMonitor, get_monitored_leads
+from connectors.imap_pool import IMAP_POOL, IdleWatcher
+from openai_llm import generate_1st_cold_email_content, stream_1st_cold_email_content
+from flask import Flask, Response, render_template, jsonify, request, stream_with_context
 from utils.email_integration import send_round_robin_email
 from constants import EmailStatus, SenderType, SheetColumns
-from utils.formatter import format_email_content, format_keys
-from utils.helper import get_description, parse_conversation_history
-from connectors.gsheet import get_leads_data, get_agency_data, update_sheet_row, get_lead_by_email
+from utils.formatter import PlaceholderStream, email_placeholder_values, subject_placeholder_values, format_email_content, format_keys, format_lead_keys, format_sse, stream_json_array
+from utils.json_stream import JSONFieldStream
+from utils.helper import generate_cold_emails, get_description, paginate_leads, parse_conversation_history, select_leads_in_rows
+from utils.metrics import METRICS
+from utils.conversation_parser import to_sheet_timestamp
+from connectors.llm_cache import LLM_CACHE
+from connectors.batch_jobs import BATCH_RUNNER
+from utils.scraper import PAGE_CACHE
+from utils.scheduler import POLLER, check_email_replies, init_scheduler
+from connectors.repository import get_leads_data, get_leads_by_status, get_lead_rows, get_agency_data, get_lead_aggregates, queue_sheet_update, get_lead_by_email, start_sync
 
 app = Flask(__name__)
-CORS(app, supports_credentials=True, origins=["http://localhost:3000"])
+CORS(app, supports_credentials=True, origins=["http://localhost:3000"], expose_headers=["X-Next-Cursor"])
 
 with app.app_context():
     EMAIL_MONITORS = [EmailMonitor(config) for config in Config.SENDER_CONFIGS]
 
+# Columns each view needs, so the large HTML and history cells are only fetched where used
+LEAD_LIST_COLUMNS = [
+    SheetColumns.NAME,
+    SheetColumns.EMAIL,
+    SheetColumns.COMPANY_NAME,
+    SheetColumns.COMPANY_DOMAIN,
+    SheetColumns.COMPANY_SIZE,
+    SheetColumns.ROLE,
+    SheetColumns.EMAIL_STATUS,
+    SheetColumns.SENDER_EMAIL,
+]
+COLD_EMAIL_COLUMNS = LEAD_LIST_COLUMNS + [
+    SheetColumns.COMPANY_BACKGROUND,
+    SheetColumns.EMAIL_CONTENT,
+]
+CONVERSATION_COLUMNS = LEAD_LIST_COLUMNS + [
+    SheetColumns.COLD_EMAIL_SUBJECT,
+    SheetColumns.LAST_SENDER,
+    SheetColumns.LAST_MESSAGE,
+    SheetColumns.CONVERSATION_HISTORY,
+]
+
+
+IDLE_WATCHERS = []
+_services_lock = threading.Lock()
+_services_started = False
+
+
+def check_mailbox(config: dict):
+    """Check one sender mailbox for replies, e.g. when IDLE reports new mail"""
+    if POLLER.poll_now(config['email']):
+        return
+    monitor = next((m for m in EMAIL_MONITORS if m.config['email'] == config['email']), None)
+    if monitor:
+        check_email_replies([monitor], get_monitored_leads())
+
+
+def check_all_mailboxes() -> dict:
+    """Check every sender mailbox not already being checked, in parallel, queueing the replies found"""
+    return check_email_replies(EMAIL_MONITORS, get_monitored_leads())
+
+
+def start_reply_push():
+    """Keep pooled IMAP sessions alive and watch every mailbox with IMAP IDLE"""
+    IMAP_POOL.start_keepalive()
+    if not Config.IMAP_IDLE:
+        return
+    for watcher in IDLE_WATCHERS:
+        watcher.stop()
+    IDLE_WATCHERS[:] = [IdleWatcher(monitor.config, check_mailbox) for monitor in EMAIL_MONITORS]
+    for watcher in IDLE_WATCHERS:
+        watcher.start()
+
+
+def start_background_services():
+    """Start the lead sync, mailbox watchers, reply poller and batch job runner once per serving process
+
+    Runs from the first request rather than at import or under __main__, so it
+    works under ``flask run`` and gunicorn alike, while the debug reloader's
+    watcher process (which imports the app but never serves) starts nothing.
+    """
+    global _services_started
+    with _services_lock:
+        if _services_started:
+            return
+        _services_started = True
+    start_sync()
+    start_reply_push()
+    init_scheduler(app, EMAIL_MONITORS, get_monitored_leads)
+    if Config.LLM_BATCH_INTERVAL:
+        BATCH_RUNNER.start(Config.LLM_BATCH_INTERVAL)
+
+
+@app.before_request
+def ensure_background_services():
+    if not _services_started:
+        start_background_services()
+
 
 @app.route("/")
 def dashboard():
-    leads = get_leads_data()
-    total_leads = len(leads)
-    outeach = 0
-    conversations = 0
+    return jsonify(get_lead_aggregates())
+
+@app.route("/api/scheduler/jobs")
+def get_scheduler_jobs():
+    return jsonify(POLLER.stats())
+
+@app.route("/api/metrics")
+def get_metrics():
+    return jsonify({
+        'counters': METRICS.snapshot(),
+        'conversation_parser_llm_fallback_rate': METRICS.ratio(
+            'conversation_parser.llm_fallback', 'conversation_parser.llm_fallback', 'conversation_parser.local'),
+        'llm_cache': LLM_CACHE.stats(),
+        'scrape_cache': PAGE_CACHE.stats(),
+        'llm_calls': METRICS.recent('llm.calls'),
+    })
+
+@app.route("/api/batch/jobs")
+def get_batch_jobs():
+    return jsonify(BATCH_RUNNER.status())
+
+@app.route("/api/batch/run", methods=['POST'])
+def run_batch_jobs():
+    """Start writing back finished enrichment jobs and submitting one for the leads still missing data
+
+    Scraping and a local provider's completions take a while, so the run
+    goes on in the background; poll /api/batch/runs/<run_id> for its report.
+    """
+    return jsonify({'success': True, 'run_id': BATCH_RUNNER.run_in_background()}), 202
+
+@app.route("/api/batch/runs/<run_id>")
+def get_batch_run(run_id):
+    run = BATCH_RUNNER.run_status(run_id)
+    if run is None:
+        return jsonify({'success': False, 'error': 'Run not found'}), 404
+    return jsonify({'success': True, **run})
+
+
+def lead_page_args(default_statuses: set[str] | None = None) -> dict:
+    """Read the status/sender/q/cursor/limit query parameters shared by the lead list views
+
+    Raises ValueError for a cursor or limit that isn't a valid number; limits
+    above LEADS_PAGE_MAX_LIMIT are lowered to it.
+    """
+    cursor = request.args.get('cursor', '0')
+    limit = request.args.get('limit')
+    if not cursor.isdigit():
+        raise ValueError("cursor must be a non-negative integer")
+    if limit is not None and not (limit.isdigit() and int(limit) >= 1):
+        raise ValueError("limit must be a positive integer")
+
+    statuses = {status.strip().lower() for status in request.args.get('status', '').split(',') if status.strip()} or None
+    if default_statuses:
+        statuses = default_statuses & statuses if statuses else default_statuses
+    return {
+        'statuses': statuses,
+        'sender': request.args.get('sender') or None,
+        'search': request.args.get('q') or None,
+        'cursor': int(cursor),
+        'limit': min(int(limit), Config.LEADS_PAGE_MAX_LIMIT) if limit is not None else None,
+    }
+
+
+def stream_leads_response(leads: list[dict], positions: list[int], next_cursor: int | None, prepare=None, prefix: str = '', suffix: str = '') -> Response:
+    """Stream the selected leads as chunked JSON, passing the next page cursor in a header"""
+    def generate():
+        for position in positions:
+            lead = leads[position]
+            if prepare:
+                prepare(lead)
+            yield format_lead_keys(lead)
+
+    response = Response(stream_with_context(stream_json_array(generate(), prefix, suffix)), mimetype='application/json')
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+    return response
 
-    for i in leads:
-        if i[SheetColumns.EMAIL_STATUS.value] == EmailStatus.SENT.value:
-            outeach += 1
-        if i[SheetColumns.EMAIL_STATUS.value] in (EmailStatus.REPLIED.value, EmailStatus.ACTIVE.value):
-            conversations += 1
 
-    return jsonify({'total_leads': total_leads, 'outreach': outeach, 'conversations': conversations})
+def default_status(lead: dict):
+    if not lead[SheetColumns.EMAIL_STATUS.value]:
+        lead[SheetColumns.EMAIL_STATUS.value] = EmailStatus.NEW.value
+
+
+def parse_lead_conversation(lead: dict):
+    history = lead[SheetColumns.CONVERSATION_HISTORY.value]
+    try:
+        conversation = ast.literal_eval(str(history)) if history else {}
+    except (ValueError, SyntaxError, MemoryError, RecursionError) as e:
+        # One malformed cell must not break a response that is already streaming
+        print(f"Unreadable conversation history for {lead.get(SheetColumns.EMAIL.value)}: {e}")
+        conversation = {}
+    lead[SheetColumns.CONVERSATION_HISTORY.value] = parse_conversation_history(conversation)
+
 
 @app.route("/api/leads")
 def get_leads():
-    leads = get_leads_data()
-    for lead in leads:
-        if not lead[SheetColumns.EMAIL_STATUS.value]:
-            lead[SheetColumns.EMAIL_STATUS.value] = EmailStatus.NEW.value
-        
-    return jsonify(format_keys(leads))
+    try:
+        page_args = lead_page_args()
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    leads = get_leads_data(LEAD_LIST_COLUMNS)
+    positions, next_cursor = paginate_leads(leads, **page_args)
+    return stream_leads_response(leads, positions, next_cursor, prepare=default_status)
 
-def get_active_replied_leads():
-    leads = get_leads_data()
-    filtered_leads = [
 
-        lead for lead in leads 
-        if lead[SheetColumns.EMAIL_STATUS.value] in (EmailStatus.ACTIVE.value, EmailStatus.REPLIED.value)
-    ]
+CONVERSATION_STATUSES = {EmailStatus.ACTIVE.value.lower(), EmailStatus.REPLIED.value.lower()}
+
+def get_active_replied_leads():
+    filtered_leads = get_leads_by_status([EmailStatus.ACTIVE, EmailStatus.REPLIED], CONVERSATION_COLUMNS)
 
     for lead in filtered_leads:
-        lead[SheetColumns.CONVERSATION_HISTORY.value] = parse_conversation_history(eval(lead[SheetColumns.CONVERSATION_HISTORY.value]))
+        parse_lead_conversation(lead)
 
     return filtered_leads
 
 
 @app.route("/api/leads/conversations")
 def get_conversations():
-    return jsonify({'success': True, 'leads': format_keys(get_active_replied_leads())})
+    try:
+        page_args = lead_page_args(CONVERSATION_STATUSES)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    leads = get_leads_data(CONVERSATION_COLUMNS)
+    positions, next_cursor = paginate_leads(leads, **page_args)
+    return stream_leads_response(leads, positions, next_cursor, prepare=parse_lead_conversation,
+                                 prefix='{"success": true, "leads": ', suffix='}')
 
 
 @app.route("/api/leads/monitor")
 def refresh_leads():
-    leads = get_leads_data()
-    for monitor in [EmailMonitor(config) for config in Config.SENDER_CONFIGS]:
-        monitor.check_replies(leads)
+    report = check_all_mailboxes()
 
     active_replied_leads = format_keys(get_active_replied_leads())
-    return jsonify({'success': True, 'leads': active_replied_leads})
+    return jsonify({'success': not report['failed'] and not report['timed_out'], 'leads': active_replied_leads, 'mailboxes': report})
+
+
+def lead_company_description(lead: dict) -> dict:
+    """The lead's company description as get_description reports it, generating and saving one if missing"""
+    if description := lead.get(SheetColumns.COMPANY_BACKGROUND.value):
+        return {"success": True, "description": description}
+    return get_description(lead[SheetColumns.EMAIL.value])
 
 
 @app.route("/api/lead/<lead_email>/generate-email", methods=['POST'])
 def generate_cold_email(lead_email):
-    leads = get_leads_data()
-    lead = next((lead for lead in leads if lead['Email'] == lead_email), None)
+    lead = get_lead_by_email(lead_email)
     if not lead:
         return jsonify({'error': 'Lead not found'}), 404
 
     agency_info = get_agency_data()
 
-    if not (company_description := lead[SheetColumns.COMPANY_BACKGROUND.value]):
-        description_result = get_description(lead_email)
-        if not description_result['success']:
-            return jsonify({'error': description_result['error']}), 400
-        
-        company_description = description_result['description']
+    description_result = lead_company_description(lead)
+    if not description_result['success']:
+        return jsonify({'error': description_result['error']}), 400
+    company_description = description_result['description']
     email_content = generate_1st_cold_email_content(lead, agency_info, company_description)
     formatted_content = format_email_content(email_content, lead, agency_info)
 
     return jsonify(formatted_content)
 
 
+@app.route("/api/lead/<lead_email>/generate-email/stream", methods=['POST'])
+def stream_cold_email(lead_email):
+    """generate-email as Server-Sent Events: formatted subject and email text as it is written, then the final result"""
+    lead = get_lead_by_email(lead_email)
+    if not lead:
+        return jsonify({'error': 'Lead not found'}), 404
+
+    agency_info = get_agency_data()
+
+    description_result = lead_company_description(lead)
+    if not description_result['success']:
+        return jsonify({'error': description_result['error']}), 400
+    company_description = description_result['description']
+
+    def events():
+        values = email_placeholder_values(lead, agency_info)
+        fields = JSONFieldStream()
+        # Substituted like format_email_content does, so the preview matches the final result
+        formatters = {'subject': PlaceholderStream(subject_placeholder_values(values)), 'email': PlaceholderStream(values)}
+        raw = []
+        try:
+            for chunk in stream_1st_cold_email_content(lead, agency_info, company_description):
+                raw.append(chunk)
+                for field, text in fields.feed(chunk):
+                    if field in formatters and (text := formatters[field].feed(text)):
+                        yield format_sse(field, {'text': text})
+            for field, formatter in formatters.items():
+                if text := formatter.flush():
+                    yield format_sse(field, {'text': text})
+            # The streamed text is a preview; the validated result is what the editor keeps
+            yield format_sse('done', format_email_content(json.loads(''.join(raw)), lead, agency_info))
+        except (ValueError, KeyError) as e:
+            yield format_sse('error', {'error': f"Invalid email generated: {e}"})
+        except openai.OpenAIError as e:
+            yield format_sse('error', {'error': f"Email generation failed: {e}"})
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def bulk_generation_args(body) -> dict:
+    """Read the emails/status/starting_row/ending_row/regenerate fields of a bulk generation body
+
+    Raises ValueError for a body or field of the wrong type.
+    """
+    if not isinstance(body, dict):
+        raise ValueError("body must be a JSON object")
+    emails = body.get('emails')
+    if emails is not None and not (isinstance(emails, list) and all(isinstance(email, str) for email in emails)):
+        raise ValueError("emails must be a list of strings")
+    statuses = body.get('status', EmailStatus.NEW.value)
+    if isinstance(statuses, str):
+        statuses = statuses.split(',')
+    if not (isinstance(statuses, list) and all(isinstance(status, str) for status in statuses)):
+        raise ValueError("status must be a string or a list of strings")
+    rows = {}
+    for name, default in (('starting_row', Config.STARTING_ROW), ('ending_row', Config.ENDING_ROW)):
+        rows[name] = body.get(name, default)
+        if isinstance(rows[name], bool) or not isinstance(rows[name], int) or rows[name] < 0:
+            raise ValueError(f"{name} must be a non-negative integer")
+    regenerate = body.get('regenerate', False)
+    if not isinstance(regenerate, bool):
+        raise ValueError("regenerate must be true or false")
+    return {
+        'emails': {email.lower() for email in emails} if emails else None,
+        'statuses': {status.strip().lower() for status in statuses if status.strip()} or None,
+        'regenerate': regenerate,
+        **rows,
+    }
+
+
+@app.route("/api/leads/generate-emails", methods=['POST'])
+def generate_cold_emails_bulk():
+    """Generate cold emails for many leads, streaming progress as Server-Sent Events
+
+    The JSON body either lists ``emails``, or filters by ``status`` (a list or
+    a comma separated string, default "New") within ``starting_row``/``ending_row`` (default Config.STARTING_ROW
+    and ENDING_ROW). Leads that already have email content are skipped unless
+    ``regenerate`` is true.
+    """
+    try:
+        args = bulk_generation_args(request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    leads = get_leads_data(COLD_EMAIL_COLUMNS)
+    if args['emails']:
+        selected = [lead for lead in leads if lead[SheetColumns.EMAIL.value].lower() in args['emails']]
+    else:
+        selected = select_leads_in_rows(leads, get_lead_rows(), args['starting_row'], args['ending_row'], statuses=args['statuses'])
+    if not args['regenerate']:
+        selected = [lead for lead in selected if not lead.get(SheetColumns.EMAIL_CONTENT.value)]
+    agency_info = get_agency_data()
+
+    def events():
+        yield format_sse('start', {'total': len(selected)})
+        succeeded = failed = 0
+        for lead_email, update, error in generate_cold_emails(selected, agency_info):
+            if error is None:
+                succeeded += 1
+                yield format_sse('progress', {'email': lead_email, 'success': True, 'subject': update[SheetColumns.COLD_EMAIL_SUBJECT.value],
+                                              'done': succeeded + failed, 'total': len(selected)})
+            else:
+                failed += 1
+                yield format_sse('progress', {'email': lead_email, 'success': False, 'error': str(error),
+                                              'done': succeeded + failed, 'total': len(selected)})
+        yield format_sse('done', {'total': len(selected), 'succeeded': succeeded, 'failed': failed})
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @app.route("/api/lead/<lead_email>/details")
 def get_lead_details(lead_email):
     lead = get_lead_by_email(lead_email)
     if not lead:
         return jsonify({'error': 'Lead not found'}), 404
-    if not (description := lead.get(SheetColumns.COMPANY_BACKGROUND.value)):
-        description_result = get_description(lead_email)
-        description = description_result['description']
-        if not description_result['success']:
-            return jsonify({'error': description_result['error']}), 400
-        
-    lead[SheetColumns.COMPANY_BACKGROUND.value] = description
+    description_result = lead_company_description(lead)
+    if not description_result['success']:
+        return jsonify({'error': description_result['error']}), 400
+    lead[SheetColumns.COMPANY_BACKGROUND.value] = description_result['description']
     
     lead_details = {
         'basic_info': {
@@ -134,6 +422,8 @@ def get_lead_details(lead_email):
 def send_cold_email(lead_email):
     data = request.json
     lead = get_lead_by_email(lead_email)
+    if not lead:
+        return jsonify({'error': 'Lead not found'}), 404
     context = {
         'paragraphs': data['email'].split('\n\n'),
         'calendar_link': Config.CALENDAR_LINK,
@@ -146,15 +436,17 @@ def send_cold_email(lead_email):
     response = send_round_robin_email(lead[SheetColumns.EMAIL.value], 
                             data['subject'], html_content)
 
-    update_sheet_row(
+    queue_sheet_update(
         lead[SheetColumns.EMAIL.value],
         {
             SheetColumns.EMAIL_STATUS.value: EmailStatus.SENT.value,
             SheetColumns.COLD_EMAIL_SUBJECT.value: data['subject'],
             SheetColumns.EMAIL_CONTENT.value: data['email'],
             SheetColumns.SENDER_EMAIL.value: response['details']['from'],
+            SheetColumns.MESSAGE_ID.value: response['message_id'],
             SheetColumns.HTML_EMAIL_CONTENT.value: html_content,
-            SheetColumns.LAST_SENDER.value: SenderType.AGENCY.value
+            SheetColumns.LAST_SENDER.value: SenderType.AGENCY.value,
+            SheetColumns.SENT_AT.value: to_sheet_timestamp(datetime.now(timezone.utc))
         }
     )
         
@@ -177,7 +469,11 @@ def update_emails():
     if not new_emails:
         return jsonify({'success': False, 'message': 'No emails provided'}), 400
     
-    Config.update_emails(new_emails)        
+    Config.update_emails(new_emails)
+    EMAIL_MONITORS[:] = [EmailMonitor(config) for config in Config.SENDER_CONFIGS]
+    if POLLER.load_leads:
+        POLLER.sync(EMAIL_MONITORS)
+    start_reply_push()
     return jsonify({
         'success': True,
         'message': 'Email configurations updated successfully'
@@ -1,6 +1,6 @@
 from connectors.email_monitor import EmailMonitor
 from config import Config
-from connectors.gsheet import get_leads_data
+from connectors.repository import get_leads_data
 from constants import SheetColumns, EmailStatus
 from app import get_active_replied_leads
 
@@ -8,6 +8,23 @@ load_dotenv()
 class Config:
     GOOGLE_SHEETS_API_KEY = os.getenv("GOOGLE_SHEETS_API_KEY")
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+    # Retries on rate limits and server errors, seconds per request, and concurrent async requests
+    OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", 5))
+    OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", 60))
+    OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", 8))
+    # Account-wide budget for completion requests
+    OPENAI_REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", 500))
+    OPENAI_TOKENS_PER_MINUTE = int(os.getenv("OPENAI_TOKENS_PER_MINUTE", 200000))
+    # Token budgets for the variable parts of prompts
+    PROMPT_HISTORY_TOKENS = int(os.getenv("PROMPT_HISTORY_TOKENS", 1500))
+    PROMPT_LEAD_INFO_TOKENS = int(os.getenv("PROMPT_LEAD_INFO_TOKENS", 400))
+    PROMPT_DESCRIPTION_TOKENS = int(os.getenv("PROMPT_DESCRIPTION_TOKENS", 1000))
+    PROMPT_EMAIL_BODY_TOKENS = int(os.getenv("PROMPT_EMAIL_BODY_TOKENS", 3000))
+    # Reuse responses to identical completion requests, up to a size cap and age
+    LLM_CACHE = os.getenv("LLM_CACHE", "true").lower() == "true"
+    LLM_CACHE_DB = os.getenv("LLM_CACHE_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_cache.db"))
+    LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", 50 * 1024 * 1024))
+    LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600))
     RESEND_API_KEYS = [
         os.getenv("RESEND_API_KEY_1"),
         os.getenv("RESEND_API_KEY_2"),
@@ -20,6 +37,57 @@ class Config:
     CALENDAR_LINK = os.getenv("CALENDAR_LINK")
     STARTING_ROW = int(os.getenv("STARTING_ROW"))
     ENDING_ROW = int(os.getenv("ENDING_ROW", 0))  # 0 means process till the end
+
+    # Seconds between change checks on the cached Leads sheet
+    LEADS_CACHE_TTL = int(os.getenv("LEADS_CACHE_TTL", 30))
+    # Google Sheets allows 60 write requests per minute per user by default
+    SHEETS_WRITES_PER_MINUTE = int(os.getenv("SHEETS_WRITES_PER_MINUTE", 60))
+
+    # "sheet" reads Google Sheets directly, "sqlite" reads a local mirror synced with it
+    LEADS_BACKEND = os.getenv("LEADS_BACKEND", "sheet")
+    LEADS_DB_PATH = os.getenv("LEADS_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "leads.db"))
+    LEADS_SYNC_INTERVAL = int(os.getenv("LEADS_SYNC_INTERVAL", 60))
+    # Largest page the lead list endpoints return
+    LEADS_PAGE_MAX_LIMIT = int(os.getenv("LEADS_PAGE_MAX_LIMIT", 500))
+
+    # Push reply notifications over IMAP IDLE instead of waiting for the next poll
+    IMAP_IDLE = os.getenv("IMAP_IDLE", "true").lower() == "true"
+    # Seconds an IMAP connection waits on the server before giving up
+    IMAP_TIMEOUT = float(os.getenv("IMAP_TIMEOUT", 30))
+    # Bytes of each reply's text part downloaded by the monitor
+    IMAP_BODY_BYTES = int(os.getenv("IMAP_BODY_BYTES", 16384))
+    # Per-mailbox UID checkpoints and the cached reply threads
+    MAILBOX_STATE_DB = os.getenv("MAILBOX_STATE_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "mailbox_state.db"))
+    # Mailboxes checked in parallel, and seconds each check may take
+    MONITOR_MAX_WORKERS = int(os.getenv("MONITOR_MAX_WORKERS", 8))
+    MONITOR_TIMEOUT = int(os.getenv("MONITOR_TIMEOUT", 120))
+    # Seconds between polls of a mailbox: the minimum right after replies, backing off to the maximum when idle
+    MONITOR_MIN_INTERVAL = int(os.getenv("MONITOR_MIN_INTERVAL", 30))
+    MONITOR_MAX_INTERVAL = int(os.getenv("MONITOR_MAX_INTERVAL", 900))
+    MONITOR_JITTER = float(os.getenv("MONITOR_JITTER", 0.2))
+    # Per-mailbox lock files shared by every worker process
+    MONITOR_LOCK_DIR = os.getenv("MONITOR_LOCK_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".monitor-locks"))
+    # Leads written to the sheet per batch by bulk cold email generation
+    BULK_WRITE_BATCH = int(os.getenv("BULK_WRITE_BATCH", 25))
+    # Threads the local conversation parser is less sure about than this go to the LLM
+    CONVERSATION_PARSER_MIN_CONFIDENCE = float(os.getenv("CONVERSATION_PARSER_MIN_CONFIDENCE", 0.7))
+    # Company website scraping: requests in flight overall and per host, seconds per request and per domain
+    SCRAPER_MAX_CONNECTIONS = int(os.getenv("SCRAPER_MAX_CONNECTIONS", 50))
+    SCRAPER_PER_HOST = int(os.getenv("SCRAPER_PER_HOST", 2))
+    SCRAPER_TIMEOUT = float(os.getenv("SCRAPER_TIMEOUT", 5))
+    SCRAPER_DOMAIN_DEADLINE = float(os.getenv("SCRAPER_DOMAIN_DEADLINE", 15))
+    # Scraped pages are reused for SCRAPER_CACHE_TTL seconds, then revalidated with a conditional GET
+    SCRAPER_CACHE = os.getenv("SCRAPER_CACHE", "true").lower() == "true"
+    SCRAPER_CACHE_DB = os.getenv("SCRAPER_CACHE_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "page_cache.db"))
+    SCRAPER_CACHE_MAX_BYTES = int(os.getenv("SCRAPER_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+    SCRAPER_CACHE_TTL = int(os.getenv("SCRAPER_CACHE_TTL", 24 * 3600))
+    # Offline enrichment: "openai" uses the Batch API, "local" answers jobs in-process with regular calls
+    LLM_BATCH_PROVIDER = os.getenv("LLM_BATCH_PROVIDER", "openai")
+    # Batch input/output files and the state file of submitted jobs
+    LLM_BATCH_DIR = os.getenv("LLM_BATCH_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_batches"))
+    # Requests per batch job, and seconds between runs of the batch job runner (0 to only run on request)
+    LLM_BATCH_MAX_REQUESTS = int(os.getenv("LLM_BATCH_MAX_REQUESTS", 1000))
+    LLM_BATCH_INTERVAL = int(os.getenv("LLM_BATCH_INTERVAL", 0))
     
     __path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.getenv("EMAIL_CONFIG_FILE"))
     __email_manager = EmailConfigManager(__path)
@@ -0,0 +1,92 @@
+import threading
+from collections import Counter
+from constants import EmailStatus, SheetColumns
+
+
+class LeadAggregates:
+    """Per-status and per-sender lead counts, kept current by the lead store.
+
+    Counts are recomputed from scratch only when the store (re)loads rows;
+    every cached update adjusts them incrementally. Rows without an email are
+    not leads and aren't counted. Sends per day come from each lead's Sent At
+    timestamp, so they are rebuilt from the sheet on every load.
+    """
+
+    COLUMNS = [SheetColumns.EMAIL_STATUS, SheetColumns.SENDER_EMAIL, SheetColumns.SENT_AT]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = 0
+        self.by_status = Counter()
+        self.by_sender = {}
+        self.sends_by_day = Counter()
+
+    @staticmethod
+    def _key(record: dict) -> tuple[str, str] | None:
+        if not record or not record.get(SheetColumns.EMAIL.value):
+            return None
+        status = record.get(SheetColumns.EMAIL_STATUS.value) or EmailStatus.NEW.value
+        return status, record.get(SheetColumns.SENDER_EMAIL.value, '')
+
+    @staticmethod
+    def _sent_day(record: dict) -> str | None:
+        """Day of the "YYYY-MM-DD HH:MM:SS" Sent At timestamp"""
+        if not record or not record.get(SheetColumns.EMAIL.value):
+            return None
+        return str(record.get(SheetColumns.SENT_AT.value) or '')[:10] or None
+
+    def _count(self, key: tuple[str, str] | None, delta: int) -> None:
+        if key is None:
+            return
+        status, sender = key
+        self.by_status[status] += delta
+        if sender:
+            self.by_sender.setdefault(sender, Counter())[status] += delta
+
+    def reset(self, records: list[dict]) -> None:
+        with self._lock:
+            self.total = 0
+            self.by_status = Counter()
+            self.by_sender = {}
+            self.sends_by_day = Counter()
+            for record in records:
+                key = self._key(record)
+                self.total += key is not None
+                self._count(key, 1)
+                if day := self._sent_day(record):
+                    self.sends_by_day[day] += 1
+
+    def apply(self, before: dict, after: dict) -> None:
+        """Move one lead from its old (status, sender) bucket and send day to its new ones"""
+        old_key, new_key = self._key(before), self._key(after)
+        old_day, new_day = self._sent_day(before), self._sent_day(after)
+        with self._lock:
+            if old_key != new_key:
+                self.total += (new_key is not None) - (old_key is not None)
+                self._count(old_key, -1)
+                self._count(new_key, 1)
+            if old_day != new_day:
+                if old_day:
+                    self.sends_by_day[old_day] -= 1
+                if new_day:
+                    self.sends_by_day[new_day] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            conversation_statuses = (EmailStatus.REPLIED.value, EmailStatus.ACTIVE.value)
+            by_sender = {}
+            for sender, counts in self.by_sender.items():
+                contacted = sum(n for status, n in counts.items() if status not in (EmailStatus.NEW.value, EmailStatus.FAILED.value))
+                replied = sum(counts[status] for status in conversation_statuses)
+                by_sender[sender] = {
+                    'by_status': {status: n for status, n in counts.items() if n},
+                    'reply_rate': round(replied / contacted, 4) if contacted else 0.0
+                }
+            return {
+                'total_leads': self.total,
+                'outreach': self.by_status[EmailStatus.SENT.value],
+                'conversations': sum(self.by_status[status] for status in conversation_statuses),
+                'by_status': {status: n for status, n in self.by_status.items() if n},
+                'by_sender': by_sender,
+                'sends_by_day': {day: n for day, n in sorted(self.sends_by_day.items()) if n}
+            }
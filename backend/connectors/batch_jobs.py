@@ -0,0 +1,322 @@
+import os
+import json
+import time
+import uuid
+import threading
+from config import Config
+from constants import EmailStatus, SheetColumns
+from connectors.llm_cache import LLM_CACHE
+from connectors.mail_threads import flatten, message_text, thread_messages
+from connectors.mailbox_state import MAILBOX_STATE
+from connectors.repository import get_leads_data
+from connectors.email_monitor import build_lead_update
+from openai_llm import company_description_request, email_conversation_request, make_completion_request, make_openai_client
+from utils.conversation_parser import parse_thread
+from utils.helper import write_lead_updates
+from utils.scraper import iter_company_descriptions
+
+# Provider batch statuses after which no more results will arrive
+FINISHED = {'completed', 'failed', 'expired', 'cancelled'}
+
+
+class OpenAIBatchProvider:
+    """Runs JSONL chat completion jobs through the OpenAI Batch API (24h window, half price)"""
+
+    def submit(self, path: str) -> str:
+        client = make_openai_client()
+        with open(path, 'rb') as f:
+            input_file = client.files.create(file=f, purpose="batch")
+        return client.batches.create(
+            input_file_id=input_file.id, endpoint="/v1/chat/completions", completion_window="24h").id
+
+    def status(self, batch_id: str) -> str:
+        return make_openai_client().batches.retrieve(batch_id).status
+
+    def results(self, batch_id: str) -> list[dict]:
+        """Output lines of a finished job; expired and cancelled jobs may have answered part of it"""
+        client = make_openai_client()
+        batch = client.batches.retrieve(batch_id)
+        if not batch.output_file_id:
+            return []
+        return [json.loads(line) for line in client.files.content(batch.output_file_id).text.splitlines() if line.strip()]
+
+
+class LocalBatchProvider:
+    """Stand-in for the Batch API that answers a job with ``complete`` as soon as it is submitted.
+
+    Input and output files mirror the Batch API format and are kept in
+    ``directory``, so a job survives a restart just like a provider-side one.
+    ``complete`` takes a request body and returns the response text.
+    """
+
+    def __init__(self, directory: str, complete=None):
+        self.directory = directory
+        self.complete = complete or (lambda body: make_completion_request(**body, use_cache=False))
+
+    def _output_path(self, batch_id: str) -> str:
+        return os.path.join(self.directory, f"{batch_id}.output.jsonl")
+
+    def submit(self, path: str) -> str:
+        batch_id = f"local_{uuid.uuid4().hex}"
+        os.makedirs(self.directory, exist_ok=True)
+        with open(path) as f, open(self._output_path(batch_id) + '.tmp', 'w') as out:
+            for line in f:
+                request = json.loads(line)
+                try:
+                    content = self.complete(request['body'])
+                    response, error = {'status_code': 200, 'body': {'choices': [{'message': {'content': content}}]}}, None
+                except Exception as e:
+                    response, error = None, {'message': str(e)}
+                out.write(json.dumps({'custom_id': request['custom_id'], 'response': response, 'error': error}) + '\n')
+        os.replace(self._output_path(batch_id) + '.tmp', self._output_path(batch_id))
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        return 'completed' if os.path.exists(self._output_path(batch_id)) else 'failed'
+
+    def results(self, batch_id: str) -> list[dict]:
+        if not os.path.exists(self._output_path(batch_id)):
+            return []
+        with open(self._output_path(batch_id)) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+
+class BatchJobRunner:
+    """Fills in company descriptions and conversations in bulk through a batch completion provider.
+
+    Each run first collects what finished jobs returned and writes it to the
+    sheet in bulk, then gathers every pending prompt not already in flight into
+    a new JSONL job. A job and the leads it covers are recorded in a state
+    file before it is uploaded, so after a crash the next run uploads or
+    collects it instead of resubmitting the same leads.
+    """
+
+    # Runs started with run_in_background that are remembered for status requests
+    MAX_RUNS = 20
+
+    def __init__(self, provider, state_path: str, max_requests: int = 1000):
+        self.provider = provider
+        self.state_path = state_path
+        self.max_requests = max_requests
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._runs_lock = threading.Lock()
+        self._runs = {}
+        self._current_run = None
+
+    def _load_state(self) -> dict:
+        if not os.path.exists(self.state_path):
+            return {'jobs': {}}
+        with open(self.state_path) as f:
+            return json.load(f)
+
+    def _save_state(self, state: dict) -> None:
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        with open(self.state_path + '.tmp', 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(self.state_path + '.tmp', self.state_path)
+
+    def _description_requests(self, leads: list[dict], busy: set[str]) -> dict[str, dict]:
+        pending = [
+            lead for lead in leads
+            if not lead.get(SheetColumns.COMPANY_BACKGROUND.value) and lead.get(SheetColumns.COMPANY_DOMAIN.value)
+            and f"description:{lead[SheetColumns.EMAIL.value]}" not in busy
+        ][:self.max_requests]
+        by_domain = {}
+        for lead in pending:
+            by_domain.setdefault(lead[SheetColumns.COMPANY_DOMAIN.value], []).append(lead)
+
+        requests = {}
+        for domain, description, error in iter_company_descriptions(list(by_domain)):
+            if error is not None:
+                print(f"Scraping {domain} failed: {error}")
+            if not description:
+                continue
+            for lead in by_domain[domain]:
+                requests[f"description:{lead[SheetColumns.EMAIL.value]}"] = {
+                    'lead': lead[SheetColumns.EMAIL.value],
+                    'body': company_description_request(domain, description),
+                }
+        return requests
+
+    def _extraction_requests(self, leads: list[dict], busy: set[str]) -> dict[str, dict]:
+        """Threads of leads with cached replies but no conversation history that the local parser can't handle"""
+        by_email = {lead[SheetColumns.EMAIL.value]: lead for lead in leads}
+        requests = {}
+        for lead_email in MAILBOX_STATE.leads_with_messages():
+            lead = by_email.get(lead_email)
+            if lead is None or lead.get(SheetColumns.CONVERSATION_HISTORY.value):
+                continue
+            for root in thread_messages(MAILBOX_STATE.lead_messages(lead_email)):
+                thread = flatten(root)
+                custom_id = f"extraction:{lead_email}:{root.message_id}"
+                if custom_id in busy or parse_thread(thread)[1] >= Config.CONVERSATION_PARSER_MIN_CONFIDENCE:
+                    continue
+                requests[custom_id] = {'lead': lead_email, 'body': email_conversation_request(message_text(thread[-1]))}
+        return requests
+
+    def _submit(self, requests: dict[str, dict], state: dict) -> str:
+        """Record a job for ``requests`` in the state file, then upload it, returning the job's id"""
+        os.makedirs(Config.LLM_BATCH_DIR, exist_ok=True)
+        job_id = f"batch_{int(time.time())}_{uuid.uuid4().hex[:8]}"
+        path = os.path.join(Config.LLM_BATCH_DIR, f"{job_id}.jsonl")
+        with open(path, 'w') as f:
+            for custom_id, request in requests.items():
+                f.write(json.dumps({'custom_id': custom_id, 'method': 'POST', 'url': '/v1/chat/completions', 'body': request['body']}) + '\n')
+        state['jobs'][job_id] = {
+            'batch_id': None,
+            'input_file': path,
+            'submitted_at': None,
+            'requests': {custom_id: {'lead': request['lead'], 'body': request['body']} for custom_id, request in requests.items()},
+        }
+        self._save_state(state)
+        self._upload(job_id, state)
+        return job_id
+
+    def _upload(self, job_id: str, state: dict) -> None:
+        job = state['jobs'][job_id]
+        job['batch_id'] = self.provider.submit(job['input_file'])
+        job['submitted_at'] = time.time()
+        self._save_state(state)
+        print(f"Submitted batch {job['batch_id']} with {len(job['requests'])} requests")
+
+    def _write_back(self, job: dict, results: list[dict], leads: dict[str, dict]) -> int:
+        """Write a finished job's answers to the sheet, returning how many leads were updated
+
+        ``leads`` is read at the start of the run, after the job was submitted;
+        columns filled in since then, by hand or by the mail monitor, keep
+        their value. A malformed answer only loses its own request.
+        """
+        updates, conversations = {}, {}
+        for result in results:
+            try:
+                request = job['requests'].get(result.get('custom_id'))
+                response = result.get('response') or {}
+                if request is None or result.get('error') or response.get('status_code') != 200:
+                    continue
+                lead = leads.get(request['lead'])
+                if lead is None:
+                    continue
+                content = response['body']['choices'][0]['message']['content'].strip()
+                if result['custom_id'].split(':', 1)[0] == 'extraction':
+                    if lead.get(SheetColumns.CONVERSATION_HISTORY.value):
+                        continue
+                    conversation = dict(json.loads(content))
+                    # Fails on answers the sheet update can't be built from
+                    build_lead_update(conversation, '')
+                    conversations.setdefault(request['lead'], {}).update(conversation)
+                else:
+                    if lead.get(SheetColumns.COMPANY_BACKGROUND.value):
+                        continue
+                    updates.setdefault(request['lead'], {})[SheetColumns.COMPANY_BACKGROUND.value] = content
+            except (KeyError, IndexError, TypeError, AttributeError, ValueError) as e:
+                print(f"Skipping malformed batch result {result.get('custom_id') if isinstance(result, dict) else result!r}: {e}")
+                continue
+            if Config.LLM_CACHE:
+                LLM_CACHE.put(LLM_CACHE.key(request['body']), content)
+
+        for lead_email, conversation in conversations.items():
+            if conversation:
+                mailbox = leads[lead_email].get(SheetColumns.SENDER_EMAIL.value, '')
+                updates.setdefault(lead_email, {}).update(build_lead_update(conversation, mailbox))
+        write_lead_updates(updates)
+        # The leads were read before the write, so later steps of this run see the new values
+        for lead_email, update in updates.items():
+            leads[lead_email].update(update)
+        return sum(len(update) > 0 for update in updates.values())
+
+    def run_once(self) -> dict:
+        """Write back finished jobs and submit a job for everything still pending"""
+        with self._lock:
+            state = self._load_state()
+            leads = {lead[SheetColumns.EMAIL.value]: lead for lead in get_leads_data()}
+            report = {'written': {}, 'running': [], 'submitted': None}
+
+            for job_id, job in list(state['jobs'].items()):
+                if job['batch_id'] is None:
+                    # Recorded but never uploaded, e.g. the process stopped or the upload failed
+                    try:
+                        self._upload(job_id, state)
+                    except Exception as e:
+                        print(f"Uploading batch job {job_id} failed: {e}")
+                    report['running'].append(job_id)
+                    continue
+                status = self.provider.status(job['batch_id'])
+                if status not in FINISHED:
+                    report['running'].append(job_id)
+                    continue
+                report['written'][job_id] = self._write_back(job, self.provider.results(job['batch_id']), leads)
+                # Requests that got no answer become pending again for the next job
+                del state['jobs'][job_id]
+                self._save_state(state)
+
+            busy = {custom_id for job in state['jobs'].values() for custom_id in job['requests']}
+            pending_leads = [lead for lead in leads.values() if lead.get(SheetColumns.EMAIL_STATUS.value) != EmailStatus.FAILED.value]
+            requests = {**self._description_requests(pending_leads, busy), **self._extraction_requests(pending_leads, busy)}
+            if requests:
+                report['submitted'] = self._submit(dict(list(requests.items())[:self.max_requests]), state)
+            return report
+
+    def run_in_background(self) -> str:
+        """Start run_once on a thread of its own and return the run's id; a run still going is reused"""
+        with self._runs_lock:
+            if self._current_run is not None and self._runs[self._current_run]['finished_at'] is None:
+                return self._current_run
+            run_id = uuid.uuid4().hex
+            self._runs[run_id] = {'id': run_id, 'started_at': time.time(), 'finished_at': None, 'report': None, 'error': None}
+            self._current_run = run_id
+            while len(self._runs) > self.MAX_RUNS:
+                del self._runs[next(iter(self._runs))]
+
+        def run():
+            report, error = None, None
+            try:
+                report = self.run_once()
+            except Exception as e:
+                print(f"Batch job run failed: {e}")
+                error = str(e)
+            with self._runs_lock:
+                self._runs[run_id].update(finished_at=time.time(), report=report, error=error)
+
+        threading.Thread(target=run, name="llm-batch-run", daemon=True).start()
+        return run_id
+
+    def run_status(self, run_id: str) -> dict | None:
+        with self._runs_lock:
+            run = self._runs.get(run_id)
+            return dict(run) if run is not None else None
+
+    def status(self) -> dict:
+        state = self._load_state()
+        return {
+            'jobs': [
+                {'id': job_id, 'batch_id': job['batch_id'], 'submitted_at': job['submitted_at'], 'requests': len(job['requests']),
+                 'leads': sorted({request['lead'] for request in job['requests'].values()})}
+                for job_id, job in state['jobs'].items()
+            ]
+        }
+
+    def _run(self, interval: float) -> None:
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Batch job run failed: {e}")
+            self._stop.wait(interval)
+
+    def start(self, interval: float) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(interval,), name="llm-batch-jobs", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+BATCH_RUNNER = BatchJobRunner(
+    LocalBatchProvider(Config.LLM_BATCH_DIR) if Config.LLM_BATCH_PROVIDER == "local" else OpenAIBatchProvider(),
+    state_path=os.path.join(Config.LLM_BATCH_DIR, "state.json"),
+    max_requests=Config.LLM_BATCH_MAX_REQUESTS,
+)
@@ -1,12 +1,38 @@
+import re
 import email
 import imaplib
 from datetime import datetime
-from connectors.gsheet import update_sheet_row
-from openai_llm import extract_email_conversation
+from config import Config
+from connectors.imap_pool import IMAP_POOL
+from connectors.imap_fetch import fetch_headers, fetch_messages
+from connectors.mail_matcher import LeadMatcher
+from connectors.mail_threads import flatten, message_record, message_text, thread_messages
+from connectors.mailbox_state import MAILBOX_STATE
+from connectors.repository import get_leads_by_status, queue_sheet_update
+from openai_llm import extract_email_conversations
+from utils.conversation_parser import parse_thread
+from utils.metrics import METRICS
 from constants import SenderType, SheetColumns, EmailStatus
 
+# Leads every mailbox check matches new mail against, and the columns matching needs
+MONITORED_STATUSES = [EmailStatus.SENT, EmailStatus.REPLIED, EmailStatus.ACTIVE]
+MONITOR_COLUMNS = [
+    SheetColumns.EMAIL,
+    SheetColumns.EMAIL_STATUS,
+    SheetColumns.COLD_EMAIL_SUBJECT,
+    SheetColumns.SENDER_EMAIL,
+    SheetColumns.MESSAGE_ID,
+]
+
+
+def get_monitored_leads() -> list[dict]:
+    return get_leads_by_status(MONITORED_STATUSES, MONITOR_COLUMNS)
+
 
 class EmailMonitor:
+    # Mailbox whose UIDs the checkpoint refers to
+    MAILBOX = 'INBOX'
+
     def __init__(self, email_config):
         """Initialize monitor for a single email account
 
@@ -22,46 +48,100 @@ class EmailMonitor:
 
     def check_replies(self, lead_emails):
         """Check replies for this specific email account"""
+        updates = {}
+        try:
+            self.collect_replies(lead_emails, updates)
+        finally:
+            self._update_leads_in_sheet(updates)
+
+    def collect_replies(self, lead_emails, updates: dict[str, dict]):
+        """Check replies without writing them, adding each replied lead's sheet update to ``updates``
+
+        ``updates`` is filled even when the check fails part way, so callers
+        can still write whatever was found before the error.
+        """
         print(f"Checking inbox for {self.config['email']}")
-        return self._check_single_inbox(lead_emails)
+        self._check_single_inbox(lead_emails, updates)
 
-    def _check_single_inbox(self, lead_emails):
-        mail = imaplib.IMAP4_SSL(
-            self.config['imap_server'], self.config['imap_port'])
+    def _mailbox_status(self, mail) -> tuple[int, int]:
+        """UIDVALIDITY and the highest UID currently assigned in MAILBOX
+
+        The mailbox is selected again rather than trusting whichever one the
+        pooled session has open, so the UIDs fetched next refer to the same
+        mailbox as the checkpoint. SELECT reports both values; STATUS is the
+        fallback for servers that leave UIDNEXT out.
+        """
+        typ, _ = mail.select(self.MAILBOX)
+        if typ != 'OK':
+            raise imaplib.IMAP4.error(f"Cannot select {self.MAILBOX}")
+        _, uidvalidity = mail.response('UIDVALIDITY')
+        _, uidnext = mail.response('UIDNEXT')
+        if uidvalidity and uidvalidity[0] and uidnext and uidnext[0]:
+            return int(uidvalidity[0]), int(uidnext[0]) - 1
+        _, data = mail.status(self.MAILBOX, '(UIDVALIDITY UIDNEXT)')
+        uidvalidity = re.search(rb'UIDVALIDITY (\d+)', data[0]).group(1)
+        uidnext = re.search(rb'UIDNEXT (\d+)', data[0]).group(1)
+        return int(uidvalidity), int(uidnext) - 1
+
+    def _leads_to_match(self, lead_emails) -> list[dict]:
+        """Every monitored lead plus any others passed in
+
+        The checkpoint covers the mailbox, not the leads a caller asked about,
+        so mail past it must be matched against every lead it could belong to
+        or the leads left out would never see those replies.
+        """
+        leads = {lead[SheetColumns.EMAIL.value]: lead for lead in get_monitored_leads()}
+        for lead in lead_emails or []:
+            leads.setdefault(lead.get(SheetColumns.EMAIL.value, ''), lead)
+        return list(leads.values())
+
+    def _check_single_inbox(self, lead_emails, updates: dict[str, dict]):
         conversations = {}
-        processed_threads = set()
         try:
-            mail.login(self.config['email'], self.config['password'])
-            mail.select('INBOX')
-            for lead in lead_emails:
-                email_id = lead[SheetColumns.EMAIL.value]
-                subject = lead[SheetColumns.COLD_EMAIL_SUBJECT.value]
-                search_criteria = f'(SUBJECT "{subject}")'
-                print(search_criteria)
-                _, messages = mail.search(None, search_criteria)
-                message_nums = messages[0].split()
-                message_nums.reverse()  # Newest first
-                conversations[email_id] = {}
-                for num in message_nums:
-                    _, msg_data = mail.fetch(num, '(RFC822)')
-                    email_message = email.message_from_bytes(msg_data[0][1])
-                    thread_id = email_message.get(
-                    'Message-ID', '') or email_message.get('Thread-Index', '')
-                    if thread_id not in processed_threads:
-                        processed_threads.add(thread_id)
-                        thread_messages = self._get_thread_messages(
-                            mail, email_message)
-                        latest_message = thread_messages[-1]
-                        conv = extract_email_conversation(latest_message)
-                        conversations[email_id] = {**conversations[email_id], **conv}
+            with IMAP_POOL.connection(self.config) as mail:
+                uidvalidity, highest_uid = self._mailbox_status(mail)
+                last_uid = MAILBOX_STATE.get_checkpoint(self.config['email'], uidvalidity)
+                if last_uid >= highest_uid:
+                    return
+
+                # One pass over the new mail, matched locally against every lead
+                matcher = LeadMatcher(self._leads_to_match(lead_emails))
+                headers = fetch_headers(mail, f'{last_uid + 1}:{highest_uid}')
+                matched = {}
+                for uid in sorted(headers, key=int, reverse=True):  # Newest first
+                    if lead_email := matcher.match(headers[uid]):
+                        matched.setdefault(lead_email, []).append(uid)
+
+                # Bodies only for messages that belong to a lead, capped to their text part
+                messages = fetch_messages(
+                    mail, [uid for uids in matched.values() for uid in uids], Config.IMAP_BODY_BYTES, headers)
+                fallbacks = []
+                for email_id, message_uids in matched.items():
+                    conversations[email_id], unsure = self._update_lead_threads(email_id, [
+                        message_record(messages[uid], f"{self.config['email']}:{uidvalidity}:{int(uid)}")
+                        for uid in message_uids if uid in messages
+                    ])
+                    fallbacks.extend((email_id, text) for text in unsure)
+
+                # Threads the parser wasn't sure about go to the LLM, all at once
+                extracted = extract_email_conversations([text for _, text in fallbacks]) if fallbacks else []
+                checkpoint = highest_uid
+                for (email_id, _), conv in zip(fallbacks, extracted):
+                    if isinstance(conv, Exception):
+                        print(f"Conversation extraction failed for {email_id}: {conv}")
+                        # Stop short of the lead's new mail so the next cycle fetches and extracts it again
+                        checkpoint = min(checkpoint, min(int(uid) for uid in matched[email_id]) - 1)
+                        continue
+                    conversations[email_id] = {**conversations[email_id], **conv}
+
+                # Messages arriving after the SELECT have higher UIDs and are picked up next cycle
+                MAILBOX_STATE.save_checkpoint(self.config['email'], uidvalidity, max(checkpoint, last_uid))
         finally:
-            mail.close()
-            mail.logout()
             for lead_email in conversations:
                 if not conversations[lead_email]:
                     continue
                 print(f"Updating {lead_email}")
-                self._update_lead_in_sheet(lead_email, conversations[lead_email])
+                updates[lead_email] = self._build_lead_update(conversations[lead_email])
 
 
     def _get_thread_participants(self, email_message):
@@ -79,25 +159,30 @@ class EmailMonitor:
         return participants
 
 
-    def _get_thread_messages(self, mail, reference_message):
-        """Get all messages in the same thread"""
-        thread_messages = []
-        references = reference_message.get(
-            'References', '') or reference_message.get('In-Reply-To', '')
-        message_id = reference_message.get('Message-ID', '')
-
-        # Search for messages in the same thread
-        search_criteria = f'(OR HEADER References "{references}" HEADER Message-ID "{message_id}")'
-        _, messages = mail.search(None, search_criteria)
+    def _update_lead_threads(self, lead_email: str, new_records: list[dict]) -> tuple[dict, list[str]]:
+        """Cache the new messages, rethread the lead locally and parse every thread they touched
 
-        for num in messages[0].split():
-            _, msg_data = mail.fetch(num, '(RFC822)')
-            thread_messages.append(email.message_from_bytes(msg_data[0][1]))
-
-        # Sort by date
-        thread_messages.sort(
-            key=lambda m: email.utils.parsedate_to_datetime(m['Date']))
-        return thread_messages
+        Returns the conversation parsed locally, and the text of each thread the
+        parser isn't confident about, to be extracted by the LLM instead.
+        """
+        MAILBOX_STATE.save_messages(self.config['email'], lead_email, new_records)
+        threads = thread_messages(MAILBOX_STATE.lead_messages(lead_email))
+
+        new_ids = {record['message_id'] for record in new_records}
+        conversation, unsure = {}, []
+        for root in threads:
+            thread = flatten(root)
+            if not new_ids & {message['message_id'] for message in thread}:
+                continue
+            conv, confidence = parse_thread(thread)
+            if confidence < Config.CONVERSATION_PARSER_MIN_CONFIDENCE:
+                METRICS.incr('conversation_parser.llm_fallback')
+                # The latest message quotes the rest of the thread
+                unsure.append(message_text(thread[-1]))
+            else:
+                METRICS.incr('conversation_parser.local')
+                conversation = {**conversation, **conv}
+        return conversation, unsure
 
 
     def _parse_email_address(self, from_header):
@@ -107,19 +192,27 @@ class EmailMonitor:
         return from_header
 
 
-    def _update_lead_in_sheet(self, lead_email: str, conversation: dict):
-        """Update the sheet with reply information"""
-        latest_conv = self._get_latest_message(conversation)
-        update_data = {
-            SheetColumns.EMAIL_STATUS.value: EmailStatus.REPLIED.value,
-            SheetColumns.LAST_SENDER.value: SenderType.AGENCY.value if latest_conv["sender"] == self.config["email"] else SenderType.CLIENT.value,
-            SheetColumns.LAST_MESSAGE.value: latest_conv["message"],
-            SheetColumns.CONVERSATION_HISTORY.value: f"{conversation}"
-        }
-    
-        update_sheet_row(lead_email, update_data)
+    def _build_lead_update(self, conversation: dict) -> dict:
+        """Build the sheet columns describing the latest reply"""
+        return build_lead_update(conversation, self.config["email"])
+
+
+    def _update_leads_in_sheet(self, updates: dict[str, dict]):
+        """Queue reply information for every lead, written to the sheet in one batch"""
+        for lead_email, update_data in updates.items():
+            queue_sheet_update(lead_email, update_data)
+
+
+def get_latest_message(conversation: dict) -> dict:
+    return sorted(list(conversation.items()), key=lambda x: datetime.strptime(x[0], "%Y-%m-%d %H:%M:%S"))[-1][1]
 
 
-    def _get_latest_message(self, conversation: dict) -> str:
-        """Get the latest message from the conversation"""
-        return sorted(list(conversation.items()), key=lambda x: datetime.strptime(x[0], "%Y-%m-%d %H:%M:%S"))[-1][1]
+def build_lead_update(conversation: dict, mailbox: str) -> dict:
+    """Sheet columns describing the latest message of a lead's conversation with ``mailbox``"""
+    latest_conv = get_latest_message(conversation)
+    return {
+        SheetColumns.EMAIL_STATUS.value: EmailStatus.REPLIED.value,
+        SheetColumns.LAST_SENDER.value: SenderType.AGENCY.value if latest_conv["sender"].lower() == mailbox.lower() else SenderType.CLIENT.value,
+        SheetColumns.LAST_MESSAGE.value: latest_conv["message"],
+        SheetColumns.CONVERSATION_HISTORY.value: f"{conversation}"
+    }
@@ -1,67 +1,435 @@
 import json
+import time
+import atexit
+import random
+import threading
 import gspread
+import requests
 from config import Config
+from constants import EmailStatus, SheetColumns
+from utils.rate_limit import TokenBucket
+from connectors.lead_store import LeadStore
+from connectors.aggregates import LeadAggregates
+from gspread.utils import numericise_all, rowcol_to_a1
+from requests.adapters import HTTPAdapter
 from oauth2client.service_account import ServiceAccountCredentials
 
+DRIVE_FILES_URL = "https://www.googleapis.com/drive/v3/files"
+
+SCOPES = [
+    'https://spreadsheets.google.com/feeds',
+    'https://www.googleapis.com/auth/spreadsheets',
+    'https://www.googleapis.com/auth/drive'
+]
+
+
+class SheetsSession:
+    """Process-wide, thread-safe holder for the authorized gspread client.
+
+    Credentials, the client (and its keep-alive HTTP session), opened
+    spreadsheets and worksheet handles are created once and reused. Token
+    refresh is handled by the client's authorized session.
+    """
+
+    def __init__(self, keyfile: str = "service_account.json", pool_size: int = 10):
+        self.keyfile = keyfile
+        self.pool_size = pool_size
+        self._lock = threading.RLock()
+        self._client = None
+        self._spreadsheets = {}
+        self._worksheets = {}
+        self._header_maps = {}
+
+    def _authorize(self) -> gspread.Client:
+        with open(self.keyfile) as f:
+            cloud_creds = json.load(f)
+        creds = ServiceAccountCredentials.from_json_keyfile_dict(cloud_creds, SCOPES)
+        client = gspread.authorize(creds)
+
+        # Size the keep-alive pool for the Flask worker threads sharing this client
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        self.http_session(client).mount("https://", adapter)
+        return client
+
+    @staticmethod
+    def http_session(client: gspread.Client):
+        """The authorized requests session backing ``client``"""
+        return getattr(client, "http_client", client).session
+
+    @property
+    def client(self) -> gspread.Client:
+        with self._lock:
+            if self._client is None:
+                self._client = self._authorize()
+            return self._client
+
+    def spreadsheet(self, sheet_ID: str) -> gspread.Spreadsheet:
+        with self._lock:
+            if sheet_ID not in self._spreadsheets:
+                self._spreadsheets[sheet_ID] = self.client.open_by_key(sheet_ID)
+            return self._spreadsheets[sheet_ID]
+
+    def worksheet(self, sheet_ID: str, title: str) -> gspread.Worksheet:
+        with self._lock:
+            key = (sheet_ID, title)
+            if key not in self._worksheets:
+                self._worksheets[key] = self.spreadsheet(sheet_ID).worksheet(title)
+            return self._worksheets[key]
+
+    def header_map(self, sheet_ID: str, title: str, refresh: bool = False) -> dict[str, int]:
+        """Header name -> 1-based column index, read from the first row once"""
+        with self._lock:
+            key = (sheet_ID, title)
+            if refresh or key not in self._header_maps:
+                header_row = self.worksheet(sheet_ID, title).row_values(1)
+                self._header_maps[key] = {name: index for index, name in enumerate(header_row, start=1)}
+            return self._header_maps[key]
+
+    def modified_time(self, sheet_ID: str) -> str:
+        """Drive modifiedTime of the spreadsheet, a cheap change probe"""
+        response = self.http_session(self.client).get(
+            f"{DRIVE_FILES_URL}/{sheet_ID}",
+            params={"fields": "modifiedTime", "supportsAllDrives": "true"}
+        )
+        response.raise_for_status()
+        return response.json()["modifiedTime"]
+
+    def reset(self) -> None:
+        """Drop the client and every cached handle, forcing a fresh handshake"""
+        with self._lock:
+            self._client = None
+            self._spreadsheets.clear()
+            self._worksheets.clear()
+            self._header_maps.clear()
+
+
+SESSION = SheetsSession()
+
+
 def connect_to_gsheet() -> gspread.Client:
-    scopes = [
-        'https://spreadsheets.google.com/feeds',
-        'https://www.googleapis.com/auth/spreadsheets',
-        'https://www.googleapis.com/auth/drive'
+    return SESSION.client
+
+def get_sheet(sheet_ID: str) -> gspread.Spreadsheet:
+    return SESSION.spreadsheet(sheet_ID)
+
+def get_worksheet(title: str) -> gspread.Worksheet:
+    return SESSION.worksheet(Config.SPREADSHEET_ID, title)
+
+def _load_lead_columns(columns: list[str]) -> list[dict]:
+    """Fetch only ``columns`` of the Leads sheet with a single values.batchGet"""
+    headers = SESSION.header_map(Config.SPREADSHEET_ID, "Leads", refresh=True)
+    present = [col for col in columns if col in headers]
+    ranges = []
+    for col in present:
+        letter = rowcol_to_a1(1, headers[col])[:-1]
+        ranges.append(f"'Leads'!{letter}2:{letter}")
+
+    response = get_sheet(Config.SPREADSHEET_ID).values_batch_get(ranges, params={"majorDimension": "COLUMNS"})
+    values = {}
+    for col, value_range in zip(present, response.get("valueRanges", [])):
+        column = value_range.get("values", [[]])
+        values[col] = numericise_all(column[0]) if column else []
+
+    row_count = max((len(column) for column in values.values()), default=0)
+    return [
+        {col: values[col][i] if i < len(values.get(col, [])) else '' for col in columns}
+        for i in range(row_count)
     ]
 
-    cloud_creds = json.load(open("service_account.json"))
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(cloud_creds, scopes)
+def _load_leads(columns: list[str] | None = None) -> list[dict]:
+    if columns is None:
+        data = get_worksheet("Leads").get_all_records() or []
+    else:
+        data = _load_lead_columns(columns)
 
-    client = gspread.authorize(creds)
-    return client
+    # Queued writes haven't reached the sheet yet, keep them visible to readers
+    pending = WRITE_QUEUE.pending()
+    for record in data:
+        if record.get(SheetColumns.EMAIL.value) in pending:
+            record.update(pending[record[SheetColumns.EMAIL.value]])
+    return data
 
-def get_sheet(sheet_ID: str) -> gspread.Spreadsheet:
-    client = connect_to_gsheet()
-    return client.open_by_key(sheet_ID)
+LEAD_STORE = LeadStore(
+    loader=_load_leads,
+    version_probe=lambda: SESSION.modified_time(Config.SPREADSHEET_ID),
+    ttl=Config.LEADS_CACHE_TTL,
+    # The header map is refreshed by every projected load, so the cached one is current
+    column_names=lambda: [name for name in SESSION.header_map(Config.SPREADSHEET_ID, "Leads") if name]
+)
+
+AGGREGATES = LeadAggregates()
+LEAD_STORE.subscribe(AGGREGATES)
+
+def get_lead_aggregates() -> dict:
+    """Dashboard counts, maintained incrementally as leads change"""
+    LEAD_STORE.ensure(LeadAggregates.COLUMNS)
+    return AGGREGATES.snapshot()
+
+def get_leads_data(columns: list[SheetColumns] | None = None) -> list[dict]:
+    """All leads, or only the given columns of each lead (Email is always included)"""
+    return LEAD_STORE.records(columns)
+
+def get_leads_by_status(statuses: list[EmailStatus], columns: list[SheetColumns] | None = None) -> list[dict]:
+    """Leads in any of ``statuses``, matched case-insensitively like the SQLite backend"""
+    statuses = {getattr(status, "value", status).lower() for status in statuses}
+    if columns is not None:
+        columns = list(columns) + [SheetColumns.EMAIL_STATUS]
+    return [
+        lead for lead in LEAD_STORE.records(columns)
+        if str(lead.get(SheetColumns.EMAIL_STATUS.value) or EmailStatus.NEW.value).lower() in statuses
+    ]
 
-def get_leads_data() -> list[dict]:
-    sheet = get_sheet(Config.SPREADSHEET_ID).worksheet("Leads")
-    data = sheet.get_all_records()
-    return data if data else []
 
+def get_lead_by_email(email: str, columns: list[SheetColumns] | None = None) -> dict | None:
+    return LEAD_STORE.get(email, columns)
 
-def get_lead_by_email(email: str) -> dict | None:
-    sheet = get_sheet(Config.SPREADSHEET_ID).worksheet("Leads")
-    email_list = sheet.col_values(2)
-    row_index = email_list.index(email) + 1
-    headers = sheet.row_values(1)
-    row_data = sheet.row_values(row_index)
-    return dict(zip(headers, row_data)) if row_data else None
+
+def get_lead_rows() -> dict[str, int]:
+    """Sheet row of every lead, by email"""
+    return LEAD_STORE.rows()
 
 
 def get_agency_data() -> dict[str, str]:
-    sheet = get_sheet(Config.SPREADSHEET_ID).worksheet("Agency Info")
+    sheet = get_worksheet("Agency Info")
     data = sheet.get_all_records()
     return {item["Category"]: item["Description"] for item in data}
 
+def get_column_index(col_name: str, title: str = "Leads") -> int:
+    headers = SESSION.header_map(Config.SPREADSHEET_ID, title)
+    if col_name not in headers:
+        # The sheet may have gained a column since the map was cached
+        headers = SESSION.header_map(Config.SPREADSHEET_ID, title, refresh=True)
+    if col_name not in headers:
+        raise ValueError(f"Column {col_name} not found in {title} sheet")
+    return headers[col_name]
+
+def update_leads_rows(updates: dict[int, dict]) -> bool:
+    """Write any number of cells across any number of rows in one values.batchUpdate call
+
+    Optional columns the sheet doesn't have are skipped.
+
+    Args:
+        updates (dict): row index -> {column name: value}
+    """
+    optional = set(SheetColumns.optional_columns())
+    data = []
+    for row_index, row_data in updates.items():
+        for col_name, value in row_data.items():
+            try:
+                col_index = get_column_index(col_name)
+            except ValueError:
+                if col_name not in optional:
+                    raise
+                continue
+            data.append({"range": f"'Leads'!{rowcol_to_a1(row_index, col_index)}", "values": [[value]]})
+    if not data:
+        return True
+
+    get_sheet(Config.SPREADSHEET_ID).values_batch_update({
+        "valueInputOption": "USER_ENTERED",
+        "data": data
+    })
+    return True
+
 def update_leads_sheet(row_index: int, data: dict) -> bool:
-    sheet = get_sheet(Config.SPREADSHEET_ID).worksheet("Leads")
-
-    header_row = sheet.row_values(1)
-    updates_with_indices = {}
-    
-    for col_name, value in data.items():
-        col_index = header_row.index(col_name) + 1
-        updates_with_indices[col_index] = value
-    
-    for col_index, value in updates_with_indices.items():
-        sheet.update_cell(row_index, col_index, value)
+    return update_leads_rows({row_index: data})
+
+def _email_cells(rows: list[int]) -> list[str]:
+    """Values of the Email column in ``rows``, read with a single values.batchGet"""
+    letter = rowcol_to_a1(1, get_column_index(SheetColumns.EMAIL.value))[:-1]
+    response = get_sheet(Config.SPREADSHEET_ID).values_batch_get([f"'Leads'!{letter}{row}" for row in rows])
+    return [
+        str(value_range["values"][0][0]) if value_range.get("values") else ''
+        for value_range in response.get("valueRanges", [])
+    ]
+
+def lead_rows(emails: list[str]) -> dict[str, int]:
+    """Current sheet row of each email found in the Leads sheet
+
+    The cached row index can be up to LEADS_CACHE_TTL old, and rows may have
+    been sorted, inserted or deleted by hand since. The Email cell of every
+    row is read back first; on any mismatch the index is rebuilt from the
+    sheet, so a write never lands on another lead's row.
+    """
+    rows = {email: LEAD_STORE.row_of(email) for email in emails}
+    known = {email: row for email, row in rows.items() if row is not None}
+    if known and _email_cells(list(known.values())) == list(known):
+        return known
+
+    LEAD_STORE.invalidate()
+    rows = {email: LEAD_STORE.row_of(email) for email in emails}
+    return {email: row for email, row in rows.items() if row is not None}
+
+def _write_lead_updates(updates: dict[str, dict], rows: dict[str, int], apply: bool = True) -> bool:
+    """Write updates to their rows; ``apply`` also writes them through to the cached leads"""
+    row_updates = {}
+    for email, data in updates.items():
+        row_updates.setdefault(rows[email], {}).update(data)
+
+    update_leads_rows(row_updates)
+    if apply:
+        for email, data in updates.items():
+            LEAD_STORE.apply_update(email, data)
+    LEAD_STORE.note_write()
     return True
 
+def update_sheet_rows(updates: dict[str, dict]) -> bool:
+    """Batch update several leads, keyed by email, in a single request"""
+    rows = lead_rows(list(updates))
+    for email in updates:
+        if email not in rows:
+            raise ValueError(f"Email {email} not found in sheet")
+    return _write_lead_updates(updates, rows)
+
 def update_sheet_row(email: str, data: dict):
-    sheet = get_sheet(Config.SPREADSHEET_ID).worksheet("Leads")
-    
-    email_list = sheet.col_values(2)
-    # try:
-    row_index = email_list.index(email) + 1
-    # except ValueError:
-    #     raise ValueError(f"Email {email} not found in sheet")
-
-    # Update the row using existing function
-    return update_leads_sheet(row_index, data)
+    return update_sheet_rows({email: data})
+
+
+class SheetWriteQueue:
+    """Background write-behind queue for lead updates.
+
+    Updates are merged per lead email while they wait, then flushed as one
+    batched write per round, at most ``requests_per_minute`` writes a minute.
+    Transient failures (429, 5xx, network) are retried with exponential
+    backoff; a batch that still fails goes back into the queue, under any
+    newer updates to the same leads, and is retried in a later round. A batch
+    the sheet rejects for good is written again lead by lead, and the leads
+    still rejected are dropped with a log message, so one bad update can't
+    hold up every later write.
+    """
+
+    def __init__(self, writer, requests_per_minute: int = 60, coalesce_delay: float = 1.0, max_retries: int = 5, max_retry_delay: float = 60.0):
+        self.writer = writer
+        self.coalesce_delay = coalesce_delay
+        self.max_retries = max_retries
+        self.max_retry_delay = max_retry_delay
+        self.last_error = None
+        self._bucket = TokenBucket(requests_per_minute, per=60.0)
+        self._pending = {}
+        self._inflight = {}
+        self._cond = threading.Condition()
+        self._enqueued_seq = 0
+        self._written_seq = 0
+        # Highest sequence number covered by a failed round
+        self._failed_seq = 0
+        self._failed_rounds = 0
+        self._thread = None
+
+    def enqueue(self, email: str, data: dict) -> None:
+        with self._cond:
+            self._pending.setdefault(email, {}).update(data)
+            self._enqueued_seq += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="sheet-write-queue", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def pending(self) -> dict[str, dict]:
+        """Updates not yet confirmed on the sheet, including the batch being written"""
+        with self._cond:
+            merged = {email: dict(data) for email, data in self._inflight.items()}
+            for email, data in self._pending.items():
+                merged.setdefault(email, {}).update(data)
+            return merged
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Block until everything queued before this call has been written
+
+        Returns False if that didn't happen within ``timeout``, or if a write
+        covering it failed; the updates then stay queued for a later retry.
+        """
+        with self._cond:
+            target = self._enqueued_seq
+            failed_before = self._failed_seq
+            self._cond.notify_all()
+            self._cond.wait_for(
+                lambda: self._written_seq >= target or self._failed_seq > failed_before and self._failed_seq >= target,
+                timeout
+            )
+            return self._written_seq >= target
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending)
+            # Give bursts of updates to the same rows a moment to merge
+            time.sleep(self.coalesce_delay)
+            with self._cond:
+                batch, self._pending = self._pending, {}
+                self._inflight = batch
+                seq = self._enqueued_seq
+
+            retry = self._write(batch)
+            with self._cond:
+                self._inflight = {}
+                if not retry:
+                    self._written_seq = seq
+                    self._failed_rounds = 0
+                else:
+                    # Updates queued during the write are newer and win
+                    for email, data in self._pending.items():
+                        retry.setdefault(email, {}).update(data)
+                    self._pending = retry
+                    self._failed_seq = seq
+                    self._failed_rounds += 1
+                self._cond.notify_all()
+                failed_rounds = self._failed_rounds
+            if failed_rounds:
+                time.sleep(min(2 ** failed_rounds, self.max_retry_delay))
+
+    def _attempt(self, batch: dict[str, dict]) -> Exception | None:
+        """Write ``batch``, retrying transient errors with backoff, and return the error it finally failed with"""
+        for attempt in range(self.max_retries + 1):
+            self._bucket.acquire()
+            try:
+                self.writer(batch)
+                return None
+            except Exception as e:
+                if not _is_transient(e) or attempt == self.max_retries:
+                    return e
+                time.sleep(min(2 ** attempt, 32) + random.random())
+
+    def _write(self, batch: dict[str, dict]) -> dict[str, dict]:
+        """Write ``batch``, returning the updates to retry in a later round"""
+        self.last_error = self._attempt(batch)
+        if self.last_error is None:
+            return {}
+        if _is_transient(self.last_error):
+            print(f"Failed to write {len(batch)} lead updates to the sheet, will retry: {self.last_error}")
+            return batch
+        if len(batch) == 1:
+            print(f"Dropping queued update for {next(iter(batch))}, the sheet rejected it: {self.last_error}")
+            return {}
+        retry = {}
+        for email, data in batch.items():
+            retry.update(self._write({email: data}))
+        return retry
+
+
+def _is_transient(error: Exception) -> bool:
+    """Whether a failed write may succeed if retried unchanged"""
+    if isinstance(error, gspread.exceptions.APIError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout, ConnectionError, TimeoutError))
+
+
+def _write_queued_updates(updates: dict[str, dict]) -> bool:
+    rows = lead_rows(list(updates))
+    known = {email: data for email, data in updates.items() if email in rows}
+    for email in updates.keys() - known.keys():
+        print(f"Dropping queued update for {email}: not found in sheet")
+    # The cached leads took these updates when they were queued, and may hold newer ones since
+    return _write_lead_updates(known, rows, apply=False)
+
+WRITE_QUEUE = SheetWriteQueue(_write_queued_updates, requests_per_minute=Config.SHEETS_WRITES_PER_MINUTE)
+atexit.register(WRITE_QUEUE.flush, 30)
+
+
+def queue_sheet_update(email: str, data: dict) -> None:
+    """Write-behind variant of update_sheet_row; the cached lead sees it immediately"""
+    LEAD_STORE.apply_update(email, data)
+    WRITE_QUEUE.enqueue(email, data)
+
+def flush_sheet_updates(timeout: float | None = None) -> bool:
+    """Barrier for callers that need their queued writes on the sheet"""
+    return WRITE_QUEUE.flush(timeout)
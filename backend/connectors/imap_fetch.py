@@ -0,0 +1,164 @@
+import re
+import email
+import quopri
+import binascii
+from itertools import takewhile
+from email.message import Message
+
+HEADER_FIELDS = ('SUBJECT', 'FROM', 'TO', 'CC', 'DATE', 'MESSAGE-ID', 'IN-REPLY-TO', 'REFERENCES', 'THREAD-INDEX')
+UID = re.compile(rb'UID (\d+)')
+TOKEN = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))')
+TAG = re.compile(r'<[^>]*>')
+NEW_RESPONSE = re.compile(rb'\d+ \(')
+LITERAL_SIZE = re.compile(rb'\{\d+\}$')
+
+
+def _quote(literal: bytes) -> bytes:
+    return b'"' + literal.replace(b'\\', b'\\\\').replace(b'"', b'\\"') + b'"'
+
+
+def _fetch_responses(data: list) -> list[tuple[bytes, bytes, bytes | None]]:
+    """Regroup imaplib FETCH output into one entry per message
+
+    Each entry is (response text without literals, response text with literals
+    spliced in as quoted strings, first literal). imaplib splits a response at
+    every literal, so the pieces following a literal belong to the same message.
+    """
+    responses = []
+    for item in data:
+        text, literal = item if isinstance(item, tuple) else (item, None)
+        if not text and literal is None:
+            continue
+        if not responses or NEW_RESPONSE.match(text):
+            responses.append([b'', b'', None])
+        current = responses[-1]
+        if literal is None:
+            current[0] += text
+            current[1] += text
+        else:
+            text = LITERAL_SIZE.sub(b'', text)
+            current[0] += text
+            current[1] += text + _quote(literal)
+            if current[2] is None:
+                current[2] = literal
+    return [tuple(response) for response in responses]
+
+
+def parse_imap_list(data: bytes):
+    """Parse an IMAP parenthesized list (e.g. a BODYSTRUCTURE) into nested Python lists"""
+    stack = [[]]
+    for match in TOKEN.finditer(data):
+        opening, closing, quoted, atom = match.groups()
+        if opening:
+            stack.append([])
+        elif closing:
+            if len(stack) == 1:
+                break
+            finished = stack.pop()
+            stack[-1].append(finished)
+        elif quoted is not None:
+            stack[-1].append(re.sub(rb'\\(.)', rb'\1', quoted).decode('utf-8', 'replace'))
+        else:
+            stack[-1].append(None if atom.upper() == b'NIL' else atom.decode('utf-8', 'replace'))
+    return stack[0]
+
+
+def find_text_part(structure: list, section: tuple = ()) -> tuple[str, str, str, str] | None:
+    """(section, subtype, transfer encoding, charset) of the best text part, preferring text/plain"""
+    if structure and isinstance(structure[0], list):
+        # Child parts come first, followed by the multipart subtype and extension data
+        children = list(takewhile(lambda child: isinstance(child, list), structure))
+        candidates = []
+        for i, child in enumerate(children, start=1):
+            if found := find_text_part(child, section + (i,)):
+                candidates.append(found)
+        plain = [found for found in candidates if found[1] == 'plain']
+        return (plain or candidates or [None])[0]
+
+    if len(structure) < 7 or str(structure[0]).lower() != 'text' or str(structure[1]).lower() not in ('plain', 'html'):
+        return None
+    params = structure[2] or []
+    charset = next((params[i + 1] for i in range(0, len(params) - 1, 2) if str(params[i]).lower() == 'charset'), 'utf-8')
+    return '.'.join(map(str, section)) or '1', structure[1].lower(), (structure[5] or '7bit').lower(), charset
+
+
+def decode_partial(payload: bytes, encoding: str, charset: str) -> str:
+    """Decode a possibly truncated body part"""
+    if encoding == 'base64':
+        payload = re.sub(rb'\s+', b'', payload)
+        payload = binascii.a2b_base64(payload[:len(payload) - len(payload) % 4])
+    elif encoding == 'quoted-printable':
+        payload = quopri.decodestring(payload)
+    try:
+        return payload.decode(charset or 'utf-8', 'replace')
+    except LookupError:
+        return payload.decode('utf-8', 'replace')
+
+
+def fetch_headers(mail, uid_set: str) -> dict[bytes, Message]:
+    """Threading and matching headers of every message in ``uid_set``, in one UID FETCH
+
+    BODY.PEEK leaves the \\Seen flag alone, so polling doesn't mark mail as read.
+    """
+    _, data = mail.uid('FETCH', uid_set, f'(UID BODY.PEEK[HEADER.FIELDS ({" ".join(HEADER_FIELDS)})])')
+    headers = {}
+    for text, _, literal in _fetch_responses(data):
+        if literal is not None and (uid := UID.search(text)):
+            headers[uid.group(1)] = email.message_from_bytes(literal)
+    return headers
+
+
+def fetch_text_bodies(mail, uids: list[bytes], max_bytes: int) -> dict[bytes, str]:
+    """The first ``max_bytes`` of each message's text part, without downloading attachments
+
+    One FETCH reads every BODYSTRUCTURE, then one FETCH per distinct part section
+    (usually just "1" or "1.1") reads the capped bodies.
+    """
+    if not uids:
+        return {}
+    _, data = mail.uid('FETCH', b','.join(uids), '(UID BODYSTRUCTURE)')
+    parts = {}
+    for text, spliced, _ in _fetch_responses(data):
+        structure_start = spliced.find(b'BODYSTRUCTURE')
+        if not (uid := UID.search(text)) or structure_start == -1:
+            continue
+        structure = parse_imap_list(spliced[structure_start + len(b'BODYSTRUCTURE'):])
+        if structure and isinstance(structure[0], list) and (text_part := find_text_part(structure[0])):
+            parts[uid.group(1)] = text_part
+
+    by_section = {}
+    for uid, (section, *_) in parts.items():
+        by_section.setdefault(section, []).append(uid)
+
+    bodies = {}
+    for section, section_uids in by_section.items():
+        _, data = mail.uid('FETCH', b','.join(section_uids), f'(UID BODY.PEEK[{section}]<0.{max_bytes}>)')
+        for text, _, literal in _fetch_responses(data):
+            if literal is None or not (uid := UID.search(text)) or uid.group(1) not in parts:
+                continue
+            _, subtype, encoding, charset = parts[uid.group(1)]
+            text = decode_partial(literal, encoding, charset)
+            bodies[uid.group(1)] = TAG.sub('', text) if subtype == 'html' else text
+    return bodies
+
+
+def fetch_messages(mail, uids: list[bytes], max_bytes: int, headers: dict[bytes, Message] | None = None) -> dict[bytes, Message]:
+    """Lightweight messages: threading headers plus the capped, decoded text body"""
+    if not uids:
+        return {}
+    headers = headers or {}
+    missing = [uid for uid in uids if uid not in headers]
+    if missing:
+        headers = {**headers, **fetch_headers(mail, b','.join(missing).decode())}
+    bodies = fetch_text_bodies(mail, uids, max_bytes)
+
+    messages = {}
+    for uid in uids:
+        if uid not in headers:
+            continue
+        message = Message()
+        for name, value in headers[uid].items():
+            message[name] = value
+        message.set_payload(bodies.get(uid, ''))
+        messages[uid] = message
+    return messages
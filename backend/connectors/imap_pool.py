@@ -0,0 +1,220 @@
+import ssl
+import time
+import select
+import imaplib
+import threading
+from contextlib import contextmanager
+from config import Config
+
+
+class _MailboxSession:
+    """A single authenticated IMAP connection with INBOX selected"""
+
+    def __init__(self, config: dict, timeout: float = Config.IMAP_TIMEOUT):
+        self.config = config
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.mail = None
+        self.last_used = 0.0
+
+    def connect(self) -> imaplib.IMAP4_SSL:
+        mail = imaplib.IMAP4_SSL(self.config['imap_server'], self.config['imap_port'], timeout=self.timeout)
+        mail.login(self.config['email'], self.config['password'])
+        mail.select('INBOX')
+        return mail
+
+    def ensure(self, keepalive: float) -> imaplib.IMAP4_SSL:
+        if self.mail is not None and time.monotonic() - self.last_used >= keepalive:
+            # Long idle connections are often dropped silently, check before reuse
+            try:
+                self.mail.noop()
+            except (imaplib.IMAP4.error, OSError):
+                self.discard()
+        if self.mail is None:
+            self.mail = self.connect()
+        self.last_used = time.monotonic()
+        return self.mail
+
+    def discard(self) -> None:
+        if self.mail is not None:
+            try:
+                self.mail.logout()
+            except (imaplib.IMAP4.error, OSError):
+                pass
+        self.mail = None
+
+
+class IMAPConnectionPool:
+    """Long-lived IMAP sessions, one per sender mailbox.
+
+    Sessions are opened on first use and reused for every check. A session
+    idle for ``keepalive`` seconds is NOOP-checked before reuse, and one that
+    fails mid-use is dropped so the next check reconnects.
+    """
+
+    def __init__(self, keepalive: float = 300):
+        self.keepalive = keepalive
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._keepalive_thread = None
+
+    def _session_for(self, config: dict) -> _MailboxSession:
+        with self._lock:
+            session = self._sessions.get(config['email'])
+            if session is None or session.config != config:
+                if session is not None:
+                    session.discard()
+                session = self._sessions[config['email']] = _MailboxSession(dict(config))
+            return session
+
+    @contextmanager
+    def connection(self, config: dict):
+        session = self._session_for(config)
+        with session.lock:
+            mail = session.ensure(self.keepalive)
+            try:
+                yield mail
+            except (imaplib.IMAP4.abort, OSError):
+                session.discard()
+                raise
+
+    def _keepalive_loop(self) -> None:
+        while True:
+            time.sleep(self.keepalive)
+            with self._lock:
+                sessions = list(self._sessions.values())
+            for session in sessions:
+                # Skip sessions that are busy; they are alive by definition
+                if session.lock.acquire(blocking=False):
+                    try:
+                        if session.mail is not None:
+                            session.ensure(self.keepalive)
+                    except (imaplib.IMAP4.error, OSError) as e:
+                        print(f"Keepalive failed for {session.config['email']}: {e}")
+                        session.discard()
+                    finally:
+                        session.lock.release()
+
+    def start_keepalive(self) -> None:
+        if self._keepalive_thread is None or not self._keepalive_thread.is_alive():
+            self._keepalive_thread = threading.Thread(target=self._keepalive_loop, name="imap-keepalive", daemon=True)
+            self._keepalive_thread.start()
+
+    def close_all(self) -> None:
+        with self._lock:
+            sessions, self._sessions = list(self._sessions.values()), {}
+        for session in sessions:
+            with session.lock:
+                session.discard()
+
+
+IMAP_POOL = IMAPConnectionPool()
+
+
+def _buffered(mail: imaplib.IMAP4_SSL) -> bool:
+    """Whether a line can be read without waiting, e.g. one already in imaplib's buffered reader
+
+    select() only sees the socket, so a response that arrived in the same
+    packet as the previous line would otherwise wait for the next one.
+    """
+    sock = mail.socket()
+    timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        return bool(mail.file.peek(1))
+    except (BlockingIOError, ssl.SSLWantReadError):
+        return False
+    finally:
+        sock.settimeout(timeout)
+
+
+def idle(mail: imaplib.IMAP4_SSL, timeout: float) -> list[bytes]:
+    """Run one IMAP IDLE (RFC 2177) round, returning the untagged responses pushed by the server
+
+    imaplib has no IDLE support, so the command is driven over the raw connection.
+    Returns as soon as the server reports new mail (EXISTS), ``timeout`` runs
+    out, or the IDLE is ended from another thread with ``DONE``.
+    """
+    tag = mail._new_tag()
+    mail.send(tag + b' IDLE\r\n')
+    if not mail.readline().startswith(b'+'):
+        raise imaplib.IMAP4.error("Server refused IDLE")
+
+    responses = []
+    sock = mail.socket()
+    deadline = time.monotonic() + timeout
+    ended = False
+    try:
+        while (remaining := deadline - time.monotonic()) > 0:
+            # Wait with select rather than a socket timeout, which would poison the buffered reader
+            if not _buffered(mail) and not select.select([sock], [], [], remaining)[0]:
+                break
+            line = mail.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("Connection closed during IDLE")
+            if line.startswith(tag):
+                ended = True
+                break
+            responses.append(line)
+            if line.rstrip().endswith(b'EXISTS'):
+                break
+    finally:
+        if not ended:
+            mail.send(b'DONE\r\n')
+            while not (line := mail.readline()).startswith(tag):
+                if not line:
+                    raise imaplib.IMAP4.abort("Connection closed ending IDLE")
+    return responses
+
+
+class IdleWatcher:
+    """Pushes new-mail notifications for one mailbox using IMAP IDLE.
+
+    IDLE occupies its connection, so the watcher keeps its own session next
+    to the pooled one used for fetching. ``on_new_mail`` is called whenever
+    the server reports new messages; connection failures back off and retry.
+    """
+
+    # RFC 2177 asks clients to re-issue IDLE at least every 29 minutes
+    IDLE_TIMEOUT = 29 * 60
+
+    def __init__(self, config: dict, on_new_mail):
+        self.config = config
+        self.on_new_mail = on_new_mail
+        self._session = _MailboxSession(dict(config))
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self) -> None:
+        backoff = 1
+        while not self._stop.is_set():
+            try:
+                mail = self._session.ensure(keepalive=0)
+                responses = idle(mail, self.IDLE_TIMEOUT)
+                backoff = 1
+                if any(line.rstrip().endswith(b'EXISTS') for line in responses):
+                    self.on_new_mail(self.config)
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                print(f"IDLE failed for {self.config['email']}: {e}")
+                self._session.discard()
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 300)
+        self._session.discard()
+
+    def start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=f"imap-idle-{self.config['email']}", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stop watching, ending an IDLE in progress so the connection is logged out right away"""
+        self._stop.set()
+        mail = self._session.mail
+        if mail is not None:
+            try:
+                mail.send(b'DONE\r\n')
+            except OSError:
+                pass
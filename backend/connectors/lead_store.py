@@ -0,0 +1,189 @@
+import time
+import threading
+from typing import Callable
+from constants import SheetColumns
+
+
+class LeadStore:
+    """In-process cache of the Leads worksheet, keyed by email.
+
+    The sheet is downloaded through ``loader`` only on first use or when
+    ``version_probe`` (a cheap call, e.g. the Drive modified time) reports a
+    change. The probe itself runs at most once every ``ttl`` seconds; in
+    between, reads are served from memory.
+
+    Reads may ask for a column projection, in which case only the missing
+    columns are fetched (``loader`` receives their names, or None for the
+    whole sheet) and merged into the cached rows by email. A read of every
+    column fetches only the ``column_names()`` not loaded yet.
+
+    It also maintains an email -> sheet row index, built from the header-named
+    Email column on reload. Rows can be sorted, inserted or deleted in the
+    sheet at any time, so writers must check a row before using it and call
+    ``invalidate`` when it no longer holds the lead.
+    """
+
+    def __init__(self, loader: Callable[[list[str] | None], list[dict]], version_probe: Callable[[], str], ttl: int = 30, header_rows: int = 1,
+                 column_names: Callable[[], list[str]] | None = None):
+        self.loader = loader
+        self.version_probe = version_probe
+        self.column_names = column_names
+        self.ttl = ttl
+        self.header_rows = header_rows
+        self._lock = threading.RLock()
+        self._records = None
+        self._rows = []
+        self._row_index = {}
+        self._columns = None
+        self._version = None
+        self._checked_at = 0.0
+        self._listeners = []
+
+    def subscribe(self, listener) -> None:
+        """Register an object with ``reset(rows)`` and ``apply(before, after)`` hooks
+
+        ``reset`` runs whenever rows are (re)loaded, ``apply`` on every local change.
+        """
+        with self._lock:
+            self._listeners.append(listener)
+            if self._records is not None:
+                listener.reset(self._rows)
+
+    def _notify_reset(self) -> None:
+        for listener in self._listeners:
+            listener.reset(self._rows)
+
+    def _notify_apply(self, before: dict, after: dict) -> None:
+        for listener in self._listeners:
+            listener.apply(before, after)
+
+    @staticmethod
+    def _names(columns) -> list[str] | None:
+        if columns is None:
+            return None
+        names = [getattr(col, "value", col) for col in columns]
+        if SheetColumns.EMAIL.value not in names:
+            names.insert(0, SheetColumns.EMAIL.value)
+        return names
+
+    def _reload(self, columns: list[str] | None) -> None:
+        # Probe before loading so edits made during the download show up next time
+        version = self.version_probe()
+        records = self.loader(columns)
+        self._records = {}
+        self._row_index = {}
+        for position, record in enumerate(records):
+            email = record.get(SheetColumns.EMAIL.value, '')
+            if email and email not in self._records:
+                self._records[email] = record
+                self._row_index[email] = position + self.header_rows + 1
+        self._rows = records
+        self._columns = None if columns is None else set(columns)
+        self._version = version
+        self._checked_at = time.monotonic()
+        self._notify_reset()
+
+    def _load_missing(self, columns: list[str] | None) -> None:
+        if self._columns is None:
+            return
+        full = columns is None
+        if full:
+            if self.column_names is None:
+                self._reload(None)
+                return
+            columns = self.column_names()
+        missing = [col for col in columns if col not in self._columns]
+        if not missing:
+            if full:
+                self._columns = None
+            return
+
+        # Merged by email, since rows may have moved in the sheet since the last load
+        loaded = {}
+        for record in self.loader([SheetColumns.EMAIL.value] + missing):
+            email = record.get(SheetColumns.EMAIL.value, '')
+            if email and email not in loaded:
+                loaded[email] = record
+        for record in self._rows:
+            fetched = loaded.get(record.get(SheetColumns.EMAIL.value, ''), {})
+            for col in missing:
+                record[col] = fetched.get(col, '')
+        # Once every column is in, full reads stop asking for the header
+        self._columns = None if full else self._columns | set(missing)
+        self._notify_reset()
+
+    def _ensure_fresh(self, columns: list[str] | None = None) -> None:
+        if self._records is None:
+            self._reload(columns)
+            return
+        if time.monotonic() - self._checked_at >= self.ttl:
+            if self.version_probe() != self._version:
+                self._reload(columns)
+                return
+            self._checked_at = time.monotonic()
+        self._load_missing(columns)
+
+    def ensure(self, columns=None) -> None:
+        """Make sure ``columns`` are loaded and fresh, without copying any rows"""
+        columns = self._names(columns)
+        with self._lock:
+            self._ensure_fresh(columns)
+
+    @staticmethod
+    def _project(record: dict, columns: list[str] | None) -> dict:
+        if columns is None:
+            return dict(record)
+        return {col: record.get(col, '') for col in columns}
+
+    def records(self, columns=None) -> list[dict]:
+        """Copies of every lead row, in sheet order, limited to ``columns`` if given"""
+        columns = self._names(columns)
+        with self._lock:
+            self._ensure_fresh(columns)
+            return [self._project(record, columns) for record in self._rows]
+
+    def get(self, email: str, columns=None) -> dict | None:
+        columns = self._names(columns)
+        with self._lock:
+            self._ensure_fresh(columns)
+            record = self._records.get(email)
+            return self._project(record, columns) if record is not None else None
+
+    def row_of(self, email: str) -> int | None:
+        """1-based sheet row holding ``email``"""
+        with self._lock:
+            self._ensure_fresh([SheetColumns.EMAIL.value])
+            return self._row_index.get(email)
+
+    def rows(self) -> dict[str, int]:
+        """1-based sheet row of every lead"""
+        with self._lock:
+            self._ensure_fresh([SheetColumns.EMAIL.value])
+            return dict(self._row_index)
+
+    def apply_update(self, email: str, data: dict) -> None:
+        """Write a local update through to the cached row, if it is loaded"""
+        with self._lock:
+            if self._records is not None and email in self._records:
+                before = dict(self._records[email])
+                self._records[email].update(data)
+                self._notify_apply(before, self._records[email])
+
+    def note_write(self) -> None:
+        """Record that this process changed the sheet
+
+        The cached rows already hold the written values, so they keep serving
+        reads until the next probe, which then reloads. Adopting the version
+        seen after the write instead would hide any external edit made since
+        the previous probe.
+        """
+        with self._lock:
+            self._version = None
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._records = None
+            self._rows = []
+            self._row_index = {}
+            self._columns = None
+            self._version = None
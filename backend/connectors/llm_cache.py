@@ -0,0 +1,91 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from config import Config
+from utils.metrics import METRICS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at);
+"""
+
+
+class LLMCache:
+    """Content-addressed cache of chat completion responses, kept in SQLite.
+
+    Entries are keyed by a hash of the request (model, messages, temperature,
+    max_tokens), expire ``ttl`` seconds after they were stored, and the least
+    recently used are evicted once the responses total more than ``max_bytes``.
+    """
+
+    def __init__(self, path: str, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+
+    @staticmethod
+    def key(request: dict) -> str:
+        fields = {name: request.get(name) for name in ('model', 'messages', 'temperature', 'max_tokens')}
+        return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is not None:
+                self._conn.execute("UPDATE responses SET used_at = ? WHERE key = ?", (now, key))
+        METRICS.incr('llm_cache.hit' if row is not None else 'llm_cache.miss')
+        return row[0] if row is not None else None
+
+    def put(self, key: str, response: str) -> None:
+        now = time.time()
+        size = len(response.encode())
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created_at, used_at) VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, now, now)
+            )
+            self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evict = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY used_at"):
+            if total <= self.max_bytes:
+                break
+            evict.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evict)
+        METRICS.incr('llm_cache.evicted', len(evict))
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {
+            'entries': entries,
+            'bytes': size,
+            'hits': METRICS.get('llm_cache.hit'),
+            'misses': METRICS.get('llm_cache.miss'),
+            'hit_rate': METRICS.ratio('llm_cache.hit', 'llm_cache.hit', 'llm_cache.miss'),
+        }
+
+
+LLM_CACHE = LLMCache(Config.LLM_CACHE_DB, max_bytes=Config.LLM_CACHE_MAX_BYTES, ttl=Config.LLM_CACHE_TTL)
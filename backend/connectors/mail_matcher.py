@@ -0,0 +1,66 @@
+import re
+from email.header import decode_header, make_header
+from email.utils import getaddresses
+from constants import SheetColumns
+
+REPLY_PREFIX = re.compile(r'^\s*((re|fw|fwd|aw|sv)\s*(\[\d+\])?\s*:\s*)+', re.IGNORECASE)
+MESSAGE_ID = re.compile(r'<[^<>\s]+>')
+
+
+def decode_mime_header(value: str) -> str:
+    try:
+        return str(make_header(decode_header(value or '')))
+    except (UnicodeDecodeError, LookupError):
+        return value or ''
+
+
+def normalize_subject(subject: str) -> str:
+    """Subject with Re:/Fwd: prefixes stripped, whitespace collapsed and case folded"""
+    subject = REPLY_PREFIX.sub('', decode_mime_header(subject))
+    return ' '.join(subject.split()).casefold()
+
+
+def normalize_message_id(message_id: str) -> str:
+    return (message_id or '').strip().strip('<>').strip().lower()
+
+
+def message_ids(value: str) -> list[str]:
+    """Every Message-ID in a References / In-Reply-To header"""
+    return [normalize_message_id(found) for found in MESSAGE_ID.findall(value or '')]
+
+
+class LeadMatcher:
+    """Matches message headers to leads without touching the IMAP server.
+
+    Built once per poll from the monitored leads; a message matches a lead
+    when it replies to the Message-ID we sent, involves the lead's address,
+    or carries the lead's cold email subject (ignoring reply prefixes), in
+    that order of confidence.
+    """
+
+    def __init__(self, leads: list[dict]):
+        self.by_message_id = {}
+        self.by_address = {}
+        self.by_subject = {}
+        for lead in leads:
+            lead_email = lead.get(SheetColumns.EMAIL.value, '')
+            if not lead_email:
+                continue
+            self.by_address.setdefault(lead_email.lower(), lead_email)
+            if sent_id := normalize_message_id(str(lead.get(SheetColumns.MESSAGE_ID.value, ''))):
+                self.by_message_id.setdefault(sent_id, lead_email)
+            if subject := normalize_subject(str(lead.get(SheetColumns.COLD_EMAIL_SUBJECT.value, ''))):
+                self.by_subject.setdefault(subject, lead_email)
+
+    def match(self, headers) -> str | None:
+        """Lead email a message belongs to, given its parsed headers"""
+        for message_id in message_ids(str(headers.get('In-Reply-To', ''))) + message_ids(str(headers.get('References', ''))):
+            if message_id in self.by_message_id:
+                return self.by_message_id[message_id]
+
+        participants = getaddresses([str(headers.get(field, '')) for field in ('From', 'To', 'Cc')])
+        for _, address in participants:
+            if address.lower() in self.by_address:
+                return self.by_address[address.lower()]
+
+        return self.by_subject.get(normalize_subject(str(headers.get('Subject', ''))))
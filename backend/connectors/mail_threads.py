@@ -0,0 +1,125 @@
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+from connectors.mail_matcher import decode_mime_header, message_ids, normalize_message_id, normalize_subject
+from utils.conversation_parser import decode_body, parse_date, to_sheet_timestamp
+
+
+class Container:
+    """A node of the JWZ thread tree; ``message`` is None for referenced but unseen messages"""
+
+    def __init__(self, message_id: str):
+        self.message_id = message_id
+        self.message = None
+        self.parent = None
+        self.children = []
+
+    def is_ancestor_of(self, other: "Container") -> bool:
+        while other is not None:
+            if other is self:
+                return True
+            other = other.parent
+        return False
+
+    def adopt(self, child: "Container") -> None:
+        if child.parent is not None:
+            child.parent.children.remove(child)
+        child.parent = self
+        self.children.append(child)
+
+
+def message_record(message, fallback_id: str) -> dict:
+    """The cached form of a message: threading headers, sender, UTC ISO date and text body"""
+    try:
+        date = parsedate_to_datetime(str(message.get('Date', ''))).astimezone(timezone.utc).isoformat()
+    except (TypeError, ValueError):
+        date = ''
+    return {
+        'message_id': normalize_message_id(str(message.get('Message-ID', ''))) or fallback_id,
+        'in_reply_to': ' '.join(message_ids(str(message.get('In-Reply-To', '')))),
+        'references': ' '.join(message_ids(str(message.get('References', '')))),
+        'subject': decode_mime_header(str(message.get('Subject', ''))),
+        'sender': decode_mime_header(str(message.get('From', ''))),
+        'date': date,
+        'body': decode_body(message),
+    }
+
+
+def thread_messages(messages: list[dict]) -> list[Container]:
+    """Group cached messages into threads with the JWZ algorithm, returning the root containers"""
+    containers = {}
+
+    def container_for(message_id: str) -> Container:
+        if message_id not in containers:
+            containers[message_id] = Container(message_id)
+        return containers[message_id]
+
+    for message in messages:
+        container = container_for(message['message_id'])
+        if container.message is not None:
+            continue  # Duplicate Message-ID, keep the first copy
+        container.message = message
+
+        references = message['references'].split()
+        for in_reply_to in message['in_reply_to'].split():
+            if in_reply_to not in references:
+                references.append(in_reply_to)
+
+        # Chain the references together, never overriding an existing parent or creating a loop
+        parent = None
+        for reference in references:
+            ref_container = container_for(reference)
+            if parent is not None and ref_container.parent is None and not ref_container.is_ancestor_of(parent):
+                parent.adopt(ref_container)
+            parent = ref_container
+
+        if parent is not None and parent is not container and not container.is_ancestor_of(parent):
+            parent.adopt(container)
+
+    roots = [container for container in containers.values() if container.parent is None]
+
+    # Drop empty containers, promoting their children
+    def prune(container: Container) -> list[Container]:
+        children = [kept for child in list(container.children) for kept in prune(child)]
+        container.children = []
+        for child in children:
+            child.parent = container
+            container.children.append(child)
+        if container.message is None:
+            for child in children:
+                child.parent = None
+            return children
+        return [container]
+
+    pruned = [kept for root in roots for kept in prune(root)]
+    for root in pruned:
+        root.parent = None
+
+    # Merge root threads that share a subject, as replies without references would otherwise split off
+    by_subject = {}
+    threads = []
+    for root in sorted(pruned, key=lambda root: root.message['date']):
+        subject = normalize_subject(root.message['subject'])
+        if subject and subject in by_subject:
+            by_subject[subject].adopt(root)
+        else:
+            by_subject.setdefault(subject, root)
+            threads.append(root)
+    return threads
+
+
+def flatten(root: Container) -> list[dict]:
+    """Every message of a thread in date order"""
+    messages, stack = [], [root]
+    while stack:
+        container = stack.pop()
+        if container.message is not None:
+            messages.append(container.message)
+        stack.extend(container.children)
+    return sorted(messages, key=lambda message: message['date'])
+
+
+def message_text(message: dict) -> str:
+    """Render a cached message the way a mail client would show it, dated in the sheet's timezone"""
+    date, _ = parse_date(message['date']) if message['date'] else (None, False)
+    date = to_sheet_timestamp(date) if date else ''
+    return f"From: {message['sender']}\nDate: {date}\nSubject: {message['subject']}\n\n{message['body']}"
@@ -0,0 +1,80 @@
+import json
+import sqlite3
+import threading
+from config import Config
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    mailbox TEXT PRIMARY KEY,
+    uidvalidity INTEGER NOT NULL,
+    last_uid INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS messages (
+    mailbox TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    lead_email TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (mailbox, message_id)
+);
+CREATE INDEX IF NOT EXISTS messages_lead ON messages (lead_email);
+"""
+
+
+class MailboxState:
+    """Monitor state kept in SQLite.
+
+    Holds per-mailbox sync checkpoints (UIDVALIDITY and highest processed
+    UID) and the cached headers and text of every message matched to a lead,
+    so conversations can be rethreaded without going back to the IMAP server.
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+
+    def get_checkpoint(self, mailbox: str, uidvalidity: int) -> int:
+        """Highest UID already processed, or 0 if unknown or UIDVALIDITY changed"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT uidvalidity, last_uid FROM checkpoints WHERE mailbox = ?", (mailbox,)
+            ).fetchone()
+        if row is None or row[0] != uidvalidity:
+            return 0
+        return row[1]
+
+    def save_checkpoint(self, mailbox: str, uidvalidity: int, last_uid: int) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO checkpoints (mailbox, uidvalidity, last_uid) VALUES (?, ?, ?) "
+                "ON CONFLICT(mailbox) DO UPDATE SET uidvalidity = excluded.uidvalidity, last_uid = excluded.last_uid",
+                (mailbox, uidvalidity, last_uid)
+            )
+
+    def reset(self, mailbox: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM checkpoints WHERE mailbox = ?", (mailbox,))
+
+    def save_messages(self, mailbox: str, lead_email: str, records: list[dict]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO messages (mailbox, message_id, lead_email, data) VALUES (?, ?, ?, ?)",
+                [(mailbox, record['message_id'], lead_email, json.dumps(record)) for record in records]
+            )
+
+    def lead_messages(self, lead_email: str) -> list[dict]:
+        """Every cached message matched to ``lead_email``, across all mailboxes"""
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM messages WHERE lead_email = ?", (lead_email,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def leads_with_messages(self) -> list[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT lead_email FROM messages").fetchall()
+        return [row[0] for row in rows]
+
+
+MAILBOX_STATE = MailboxState(Config.MAILBOX_STATE_DB)
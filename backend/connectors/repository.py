@@ -0,0 +1,21 @@
+"""Lead storage backend selected by ``Config.LEADS_BACKEND``.
+
+``sheet`` (the default) talks to Google Sheets through the cached lead
+store, ``sqlite`` serves reads from a local mirror that is synced with the
+sheet in the background. Both expose the same functions.
+"""
+from config import Config
+
+if Config.LEADS_BACKEND == "sqlite":
+    from connectors.sqlite_store import (
+        get_leads_data, get_leads_by_status, get_lead_by_email, get_lead_rows, get_agency_data, get_lead_aggregates,
+        update_sheet_row, update_sheet_rows, queue_sheet_update, flush_sheet_updates, start_sync
+    )
+else:
+    from connectors.gsheet import (
+        get_leads_data, get_leads_by_status, get_lead_by_email, get_lead_rows, get_agency_data, get_lead_aggregates,
+        update_sheet_row, update_sheet_rows, queue_sheet_update, flush_sheet_updates
+    )
+
+    def start_sync() -> None:
+        """The sheet backend reads the sheet directly, there is no mirror to sync"""
@@ -0,0 +1,353 @@
+import json
+import sqlite3
+import hashlib
+import threading
+from config import Config
+from connectors import gsheet
+from constants import EmailStatus, SheetColumns
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leads (
+    email TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    status TEXT NOT NULL COLLATE NOCASE,
+    sender TEXT NOT NULL DEFAULT '' COLLATE NOCASE,
+    domain TEXT NOT NULL DEFAULT '' COLLATE NOCASE,
+    data TEXT NOT NULL,
+    sheet_hash TEXT,
+    dirty_columns TEXT
+);
+CREATE INDEX IF NOT EXISTS leads_status ON leads (status);
+CREATE INDEX IF NOT EXISTS leads_domain ON leads (domain);
+CREATE INDEX IF NOT EXISTS leads_position ON leads (position);
+CREATE INDEX IF NOT EXISTS leads_dirty ON leads (dirty_columns) WHERE dirty_columns IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS agency_info (
+    category TEXT PRIMARY KEY,
+    description TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class SQLiteLeadRepository:
+    """Local SQLite mirror of the Leads and Agency Info sheets.
+
+    Reads are indexed local queries. Local updates are applied immediately
+    and remembered as dirty columns until ``SheetSync`` pushes them; while a
+    column is dirty the local value wins over whatever the sheet says.
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+
+    @staticmethod
+    def _project(data: dict, columns) -> dict:
+        if columns is None:
+            return data
+        names = [getattr(col, "value", col) for col in columns]
+        if SheetColumns.EMAIL.value not in names:
+            names.insert(0, SheetColumns.EMAIL.value)
+        return {name: data.get(name, '') for name in names}
+
+    @staticmethod
+    def _indexed(data: dict) -> tuple[str, str, str]:
+        return (
+            data.get(SheetColumns.EMAIL_STATUS.value) or EmailStatus.NEW.value,
+            data.get(SheetColumns.SENDER_EMAIL.value, ''),
+            data.get(SheetColumns.COMPANY_DOMAIN.value, ''),
+        )
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM leads LIMIT 1").fetchone() is None
+
+    def get_leads_data(self, columns=None) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM leads ORDER BY position").fetchall()
+        return [self._project(json.loads(row["data"]), columns) for row in rows]
+
+    def get_leads_by_status(self, statuses, columns=None) -> list[dict]:
+        statuses = [getattr(status, "value", status) for status in statuses]
+        placeholders = ", ".join("?" for _ in statuses)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT data FROM leads WHERE status IN ({placeholders}) ORDER BY position", statuses
+            ).fetchall()
+        return [self._project(json.loads(row["data"]), columns) for row in rows]
+
+    def get_lead_by_email(self, email: str, columns=None) -> dict | None:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM leads WHERE email = ?", (email,)).fetchone()
+        return self._project(json.loads(row["data"]), columns) if row else None
+
+    def get_lead_rows(self) -> dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT email, position FROM leads").fetchall()
+        # Positions count the sheet's records, which start on the row below the header
+        return {row["email"]: row["position"] + 2 for row in rows}
+
+    def get_agency_data(self) -> dict[str, str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT category, description FROM agency_info").fetchall()
+        return {row["category"]: row["description"] for row in rows}
+
+    def update_sheet_rows(self, updates: dict[str, dict]) -> bool:
+        with self._lock, self._conn:
+            for email, update in updates.items():
+                row = self._conn.execute("SELECT data, dirty_columns FROM leads WHERE email = ?", (email,)).fetchone()
+                if row is None:
+                    raise ValueError(f"Email {email} not found in sheet")
+                data = json.loads(row["data"])
+                data.update(update)
+                dirty = json.loads(row["dirty_columns"] or "[]")
+                dirty = sorted(set(dirty) | set(update))
+                status, sender, domain = self._indexed(data)
+                self._conn.execute(
+                    "UPDATE leads SET data = ?, status = ?, sender = ?, domain = ?, dirty_columns = ? WHERE email = ?",
+                    (json.dumps(data), status, sender, domain, json.dumps(dirty), email)
+                )
+        return True
+
+    @staticmethod
+    def _status_name(status: str) -> str:
+        """The EmailStatus spelling of a status the sheet may have in any case"""
+        for known in EmailStatus:
+            if known.value.lower() == status.lower():
+                return known.value
+        return status
+
+    def get_lead_aggregates(self) -> dict:
+        # Sends per day come from the mirrored "YYYY-MM-DD HH:MM:SS" Sent At timestamps, like the sheet backend
+        sent_at = f'$."{SheetColumns.SENT_AT.value}"'
+        with self._lock:
+            total = self._conn.execute("SELECT COUNT(*) FROM leads").fetchone()[0]
+            status_rows = self._conn.execute("SELECT MIN(status), COUNT(*) FROM leads GROUP BY LOWER(status)").fetchall()
+            sender_rows = self._conn.execute(
+                "SELECT sender, MIN(status), COUNT(*) FROM leads WHERE sender != '' GROUP BY sender, LOWER(status)"
+            ).fetchall()
+            sends_by_day = dict(self._conn.execute(
+                "SELECT day, COUNT(*) FROM (SELECT substr(CAST(json_extract(data, ?) AS TEXT), 1, 10) AS day FROM leads) "
+                "WHERE day != '' GROUP BY day ORDER BY day",
+                (sent_at,)
+            ).fetchall())
+
+        by_status = {self._status_name(status): count for status, count in status_rows}
+        conversation_statuses = (EmailStatus.REPLIED.value, EmailStatus.ACTIVE.value)
+        by_sender = {}
+        for sender, status, count in sender_rows:
+            by_sender.setdefault(sender, {'by_status': {}})['by_status'][self._status_name(status)] = count
+        for counts in by_sender.values():
+            statuses = counts['by_status']
+            contacted = sum(n for status, n in statuses.items() if status not in (EmailStatus.NEW.value, EmailStatus.FAILED.value))
+            replied = sum(statuses.get(status, 0) for status in conversation_statuses)
+            counts['reply_rate'] = round(replied / contacted, 4) if contacted else 0.0
+
+        return {
+            'total_leads': total,
+            'outreach': by_status.get(EmailStatus.SENT.value, 0),
+            'conversations': sum(by_status.get(status, 0) for status in conversation_statuses),
+            'by_status': by_status,
+            'by_sender': by_sender,
+            'sends_by_day': sends_by_day
+        }
+
+    # Sync support
+
+    def dirty_updates(self) -> dict[str, dict]:
+        """Locally changed columns that haven't been pushed to the sheet"""
+        with self._lock:
+            rows = self._conn.execute("SELECT email, data, dirty_columns FROM leads WHERE dirty_columns IS NOT NULL").fetchall()
+        updates = {}
+        for row in rows:
+            data = json.loads(row["data"])
+            updates[row["email"]] = {col: data.get(col, '') for col in json.loads(row["dirty_columns"])}
+        return updates
+
+    def mark_pushed(self, pushed: dict[str, dict]) -> None:
+        """Clear dirty columns whose value is still the one that was pushed"""
+        with self._lock, self._conn:
+            for email, update in pushed.items():
+                row = self._conn.execute("SELECT data, dirty_columns FROM leads WHERE email = ?", (email,)).fetchone()
+                if row is None or row["dirty_columns"] is None:
+                    continue
+                data = json.loads(row["data"])
+                dirty = [col for col in json.loads(row["dirty_columns"]) if col not in update or data.get(col) != update[col]]
+                self._conn.execute(
+                    "UPDATE leads SET dirty_columns = ? WHERE email = ?",
+                    (json.dumps(dirty) if dirty else None, email)
+                )
+
+    def apply_sheet_rows(self, records: list[dict]) -> int:
+        """Merge the sheet's rows into the mirror, returning how many rows changed"""
+        changed = 0
+        seen = set()
+        with self._lock, self._conn:
+            stored = {
+                row["email"]: row
+                for row in self._conn.execute("SELECT email, position, data, sheet_hash, dirty_columns FROM leads")
+            }
+            for position, record in enumerate(records):
+                email = record.get(SheetColumns.EMAIL.value, '')
+                if not email or email in seen:
+                    continue
+                seen.add(email)
+                sheet_hash = hashlib.sha1(json.dumps(record, sort_keys=True, default=str).encode()).hexdigest()
+                current = stored.get(email)
+                if current is not None and current["sheet_hash"] == sheet_hash:
+                    if current["position"] != position:
+                        self._conn.execute("UPDATE leads SET position = ? WHERE email = ?", (position, email))
+                    continue
+
+                data = dict(record)
+                dirty = json.loads(current["dirty_columns"] or "[]") if current is not None else []
+                if dirty:
+                    local = json.loads(current["data"])
+                    data.update({col: local.get(col, '') for col in dirty})
+                status, sender, domain = self._indexed(data)
+                self._conn.execute(
+                    "INSERT INTO leads (email, position, status, sender, domain, data, sheet_hash, dirty_columns) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(email) DO UPDATE SET "
+                    "position = excluded.position, status = excluded.status, sender = excluded.sender, "
+                    "domain = excluded.domain, data = excluded.data, sheet_hash = excluded.sheet_hash",
+                    (email, position, status, sender, domain, json.dumps(data), sheet_hash, json.dumps(dirty) if dirty else None)
+                )
+                changed += 1
+
+            # Rows removed from the sheet go too, unless they still hold unpushed changes
+            for email, row in stored.items():
+                if email not in seen and row["dirty_columns"] is None:
+                    self._conn.execute("DELETE FROM leads WHERE email = ?", (email,))
+                    changed += 1
+        return changed
+
+    def get_sync_state(self, key: str) -> str | None:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def set_sync_state(self, key: str, value: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO sync_state (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value)
+            )
+
+    def apply_agency_data(self, agency: dict[str, str]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM agency_info")
+            self._conn.executemany(
+                "INSERT INTO agency_info (category, description) VALUES (?, ?)", agency.items()
+            )
+
+
+class SheetSync:
+    """Two-way sync between the SQLite mirror and the Google Sheet.
+
+    ``push`` writes dirty local columns to the sheet in one batch, ``pull``
+    merges rows that changed on the sheet (detected by a per-row hash). The
+    sheet is only downloaded when its Drive modified time differs from the
+    one seen at the last pull, which is kept in the mirror across restarts.
+    """
+
+    def __init__(self, repository: SQLiteLeadRepository, interval: int = 60):
+        self.repository = repository
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def push(self) -> int:
+        updates = self.repository.dirty_updates()
+        known = {email: data for email, data in updates.items() if gsheet.get_lead_by_email(email, [SheetColumns.EMAIL])}
+        if known:
+            gsheet.update_sheet_rows(known)
+            self.repository.mark_pushed(known)
+        return len(known)
+
+    def pull(self) -> int:
+        # Probe before downloading so edits made during the download show up next time
+        version = gsheet.SESSION.modified_time(Config.SPREADSHEET_ID)
+        if version == self.repository.get_sync_state('sheet_version'):
+            return 0
+        changed = self.repository.apply_sheet_rows(gsheet.get_worksheet("Leads").get_all_records() or [])
+        self.repository.apply_agency_data(gsheet.get_agency_data())
+        self.repository.set_sync_state('sheet_version', version)
+        return changed
+
+    def sync(self) -> dict:
+        with self._lock:
+            return {'pushed': self.push(), 'pulled': self.pull()}
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"Error syncing leads with the sheet: {e}")
+
+    def start(self) -> None:
+        """Start background syncing, first filling an empty mirror if the sheet is reachable"""
+        if self.repository.is_empty():
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"Initial sync with the sheet failed, serving local data: {e}")
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sheet-sync", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+REPOSITORY = SQLiteLeadRepository(Config.LEADS_DB_PATH)
+SYNC = SheetSync(REPOSITORY, interval=Config.LEADS_SYNC_INTERVAL)
+
+
+def get_leads_data(columns: list[SheetColumns] | None = None) -> list[dict]:
+    return REPOSITORY.get_leads_data(columns)
+
+def get_leads_by_status(statuses: list[EmailStatus], columns: list[SheetColumns] | None = None) -> list[dict]:
+    return REPOSITORY.get_leads_by_status(statuses, columns)
+
+def get_lead_by_email(email: str, columns: list[SheetColumns] | None = None) -> dict | None:
+    return REPOSITORY.get_lead_by_email(email, columns)
+
+def get_lead_rows() -> dict[str, int]:
+    return REPOSITORY.get_lead_rows()
+
+def get_agency_data() -> dict[str, str]:
+    return REPOSITORY.get_agency_data()
+
+def get_lead_aggregates() -> dict:
+    return REPOSITORY.get_lead_aggregates()
+
+def update_sheet_rows(updates: dict[str, dict]) -> bool:
+    return REPOSITORY.update_sheet_rows(updates)
+
+def update_sheet_row(email: str, data: dict):
+    return update_sheet_rows({email: data})
+
+def queue_sheet_update(email: str, data: dict) -> None:
+    """Local writes are already deferred; SheetSync pushes them to the sheet"""
+    update_sheet_rows({email: data})
+
+def flush_sheet_updates(timeout: float | None = None) -> bool:
+    """Push pending local changes to the sheet right away"""
+    SYNC.push()
+    return gsheet.flush_sheet_updates(timeout)
+
+def start_sync() -> None:
+    """Start syncing the mirror with the sheet in the background"""
+    SYNC.start()
@@ -26,6 +26,7 @@ class SheetColumns(str, Enum):
     THREAD_SUBJECT = "Thread Subject"
     LAST_MESSAGE_ID = "Last Message ID"
     INDUSTRY = "Industry"
+    SENT_AT = "Sent At"
 
     @classmethod
     def required_columns(cls) -> list[str]:
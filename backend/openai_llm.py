@@ -1,15 +1,74 @@
 import json
+import asyncio
+import threading
+import concurrent.futures
+from typing import Iterator
 import openai
 from config import Config
 from constants import SheetColumns
-from utils.scraper import get_company_description
+from connectors.llm_cache import LLM_CACHE
+from utils.metrics import METRICS
+from utils.rate_limit import TokenBucket
+from utils.prompts import count_message_tokens, lead_prompt_info, trim_history, truncate_tokens
+from utils.scraper import get_company_description, get_company_description_async
 
 openai.api_key = Config.OPENAI_API_KEY
 
+_client = None
+_async_client = None
+_async_loop = None
+_async_semaphore = None
+_client_lock = threading.Lock()
+
+# Requests and (estimated) tokens per minute shared by every completion, cache hits excluded
+REQUEST_BUDGET = TokenBucket(Config.OPENAI_REQUESTS_PER_MINUTE)
+TOKEN_BUDGET = TokenBucket(Config.OPENAI_TOKENS_PER_MINUTE)
+
+
 def make_openai_client() -> openai.OpenAI:
-    return openai.OpenAI(api_key=Config.OPENAI_API_KEY)
+    """The shared client; its HTTP connection pool is kept alive across requests
+
+    The SDK retries rate limits (429), timeouts and 5xx responses itself,
+    backing off and honouring Retry-After.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = openai.OpenAI(
+                api_key=Config.OPENAI_API_KEY, max_retries=Config.OPENAI_MAX_RETRIES, timeout=Config.OPENAI_TIMEOUT)
+        return _client
+
+
+def _event_loop() -> asyncio.AbstractEventLoop:
+    """Background event loop owning the async client, so its connections outlive each batch of calls"""
+    global _async_client, _async_loop, _async_semaphore
+    with _client_lock:
+        if _async_loop is None:
+            _async_loop = asyncio.new_event_loop()
+            threading.Thread(target=_async_loop.run_forever, name="openai-async", daemon=True).start()
+            _async_client = openai.AsyncOpenAI(
+                api_key=Config.OPENAI_API_KEY, max_retries=Config.OPENAI_MAX_RETRIES, timeout=Config.OPENAI_TIMEOUT)
+            _async_semaphore = asyncio.Semaphore(Config.OPENAI_MAX_CONCURRENCY)
+        return _async_loop
+
+
+def submit(coroutine) -> concurrent.futures.Future:
+    """Schedule a coroutine on the shared event loop, returning a future usable from any thread"""
+    return asyncio.run_coroutine_threadsafe(coroutine, _event_loop())
 
-def make_completion_request(messages: list[dict], model: str="gpt-3.5-turbo", temperature: float=0.3, max_tokens: int=None) -> openai.Completion:
+
+def run_concurrently(coroutines) -> list:
+    """Run coroutines on the shared event loop and wait for all of them
+
+    Results keep the input order; a failed call leaves its exception in place
+    of the result instead of cancelling the others.
+    """
+    async def gather():
+        return await asyncio.gather(*coroutines, return_exceptions=True)
+    return submit(gather()).result()
+
+
+def _completion_kwargs(messages: list[dict], model: str, temperature: float, max_tokens: int | None) -> dict:
     kwargs = {
         "model": model,
         "messages": messages,
@@ -17,15 +76,120 @@ def make_completion_request(messages: list[dict], model: str="gpt-3.5-turbo", te
     }
     if max_tokens:
         kwargs["max_tokens"] = max_tokens
+    return kwargs
+
+
+def _estimate_tokens(kwargs: dict) -> int:
+    """Prompt tokens counted locally plus the completion allowance"""
+    return count_message_tokens(kwargs['messages'], kwargs['model']) + (kwargs.get('max_tokens') or 256)
+
+
+def _record_usage(kwargs: dict, usage) -> None:
+    """Count a call's input and output tokens, as reported by the API"""
+    if usage is None:
+        return
+    details = getattr(usage, 'prompt_tokens_details', None)
+    call = {
+        'model': kwargs['model'],
+        'input_tokens': usage.prompt_tokens,
+        'cached_input_tokens': getattr(details, 'cached_tokens', 0) or 0,
+        'output_tokens': usage.completion_tokens,
+    }
+    METRICS.incr('llm.calls')
+    METRICS.incr('llm.input_tokens', call['input_tokens'])
+    METRICS.incr('llm.cached_input_tokens', call['cached_input_tokens'])
+    METRICS.incr('llm.output_tokens', call['output_tokens'])
+    METRICS.record('llm.calls', call)
+
+
+def _acquire_budget(kwargs: dict) -> None:
+    REQUEST_BUDGET.acquire()
+    TOKEN_BUDGET.acquire(min(_estimate_tokens(kwargs), TOKEN_BUDGET.capacity))
+
+
+def _cache_key(kwargs: dict, use_cache: bool) -> str | None:
+    return LLM_CACHE.key(kwargs) if use_cache and Config.LLM_CACHE else None
+
+
+def _store(key: str | None, content: str, validate=None) -> None:
+    """Cache a response, unless ``validate`` rejects it (e.g. malformed JSON that should be retried)"""
+    if key is None:
+        return
+    if validate is not None:
+        try:
+            validate(content)
+        except ValueError:
+            return
+    LLM_CACHE.put(key, content)
+
 
+def make_completion_request(messages: list[dict], model: str="gpt-3.5-turbo", temperature: float=0.3, max_tokens: int=None, use_cache: bool=True, validate=None) -> openai.Completion:
+    """Chat completion text, served from the response cache when the same request was made before
+
+    Pass ``use_cache=False`` for a fresh response; generated emails and
+    replies do, since a new call should give a new variation. Only
+    deterministic calls such as extraction and company descriptions are cached.
+    """
+    kwargs = _completion_kwargs(messages, model, temperature, max_tokens)
+    key = _cache_key(kwargs, use_cache)
+    if key and (cached := LLM_CACHE.get(key)) is not None:
+        return cached
+
+    _acquire_budget(kwargs)
     client = make_openai_client()
-    return client.chat.completions.create(**kwargs).choices[0].message.content.strip()
+    response = client.chat.completions.create(**kwargs)
+    _record_usage(kwargs, response.usage)
+    content = response.choices[0].message.content.strip()
+    _store(key, content, validate)
+    return content
 
 
-def generate_1st_cold_email_content(lead: dict, agency_info: dict, company_description: str) -> str:
-    recipient_name = lead.get(SheetColumns.NAME.value, "").split(" ")[0]
-    company = lead.get(SheetColumns.COMPANY_NAME.value, "")
-    prompt = """You are an expert in writing friendly, casual, and to-the-point cold emails. Your task is to generate a short, casual, personalized cold email using ONLY the following variables - DO NOT CREATE OR INSERT ANY OTHER VARIABLES OR PLACEHOLDERS:
+def stream_completion_request(messages: list[dict], model: str="gpt-3.5-turbo", temperature: float=0.3, max_tokens: int=None, use_cache: bool=True, validate=None) -> Iterator[str]:
+    """make_completion_request, yielding the response text as it is generated
+
+    A cached response is yielded in one piece; a streamed one is cached once complete.
+    """
+    kwargs = _completion_kwargs(messages, model, temperature, max_tokens)
+    key = _cache_key(kwargs, use_cache)
+    if key and (cached := LLM_CACHE.get(key)) is not None:
+        yield cached
+        return
+
+    _acquire_budget(kwargs)
+    client = make_openai_client()
+    parts = []
+    for chunk in client.chat.completions.create(**kwargs, stream=True, stream_options={"include_usage": True}):
+        if chunk.choices and (delta := chunk.choices[0].delta.content):
+            parts.append(delta)
+            yield delta
+        if chunk.usage:
+            _record_usage(kwargs, chunk.usage)
+    _store(key, ''.join(parts).strip(), validate)
+
+
+async def make_completion_request_async(messages: list[dict], model: str="gpt-3.5-turbo", temperature: float=0.3, max_tokens: int=None, use_cache: bool=True, validate=None) -> str:
+    """make_completion_request on the async client, with at most OPENAI_MAX_CONCURRENCY calls in flight
+
+    Must run on the shared loop, e.g. through run_concurrently. Cache lookups
+    run on a worker thread so SQLite never blocks the loop.
+    """
+    kwargs = _completion_kwargs(messages, model, temperature, max_tokens)
+    key = _cache_key(kwargs, use_cache)
+    if key and (cached := await asyncio.to_thread(LLM_CACHE.get, key)) is not None:
+        return cached
+
+    _event_loop()
+    async with _async_semaphore:
+        await asyncio.to_thread(_acquire_budget, kwargs)
+        response = await _async_client.chat.completions.create(**kwargs)
+    _record_usage(kwargs, response.usage)
+    content = response.choices[0].message.content.strip()
+    await asyncio.to_thread(_store, key, content, validate)
+    return content
+
+
+# Built once and sent first, unchanged, so the provider can cache the prompt prefix
+COLD_EMAIL_SYSTEM_PROMPT = """You are an expert in writing friendly, casual, and to-the-point cold emails. Your task is to generate a short, casual, personalized cold email using ONLY the following variables - DO NOT CREATE OR INSERT ANY OTHER VARIABLES OR PLACEHOLDERS:
 
 Available Variables (use exactly as shown):
 {recipient_name}
@@ -68,55 +232,99 @@ Respond with JSON containing subject and email content only:
   "subject": "<subject line>",
   "email": "<email content>"
 }"""
+COLD_EMAIL_SYSTEM_MESSAGE = {"role": "system", "content": COLD_EMAIL_SYSTEM_PROMPT}
 
-    messages = [
-        {
-            "role": "system",
-            "content": prompt
-        },
+
+def _cold_email_messages(lead: dict) -> list[dict]:
+    recipient_name = lead.get(SheetColumns.NAME.value, "").split(" ")[0]
+    company = lead.get(SheetColumns.COMPANY_NAME.value, "")
+    return [
+        COLD_EMAIL_SYSTEM_MESSAGE,
         {
             "role": "user", 
             "content": f"Generate a cold email for {recipient_name} at {company}"
         }
     ]
-    
-    return json.loads(make_completion_request(messages))
 
-def generate_company_description(company_domain: str) -> str:
-    description = get_company_description(company_domain)
-    
+
+def generate_1st_cold_email_content(lead: dict, agency_info: dict, company_description: str, use_cache: bool = False) -> str:
+    return json.loads(make_completion_request(_cold_email_messages(lead), use_cache=use_cache, validate=json.loads))
+
+
+def stream_1st_cold_email_content(lead: dict, agency_info: dict, company_description: str, use_cache: bool = False) -> Iterator[str]:
+    """Raw JSON text of the cold email as the model writes it"""
+    return stream_completion_request(_cold_email_messages(lead), use_cache=use_cache, validate=json.loads)
+
+
+async def generate_1st_cold_email_content_async(lead: dict, agency_info: dict, company_description: str, use_cache: bool = False) -> dict:
+    return json.loads(await make_completion_request_async(_cold_email_messages(lead), use_cache=use_cache, validate=json.loads))
+
+
+def _company_description_messages(company_domain: str, description: str) -> list[dict]:
     prompt = (
             f"Here is some text extracted from the homepage of {company_domain}:\n\n"
-            f"{description}\n\n"
+            f"{truncate_tokens(description, Config.PROMPT_DESCRIPTION_TOKENS)}\n\n"
             "Provide a brief and professional summary of what this company does."
     )
+    return [{"role": "user", "content": prompt}]
+
+
+def company_description_request(company_domain: str, description: str) -> dict:
+    """The completion request generate_company_description makes, e.g. for a batch job"""
+    return _completion_kwargs(_company_description_messages(company_domain, description), "gpt-3.5-turbo", 0.5, 150)
+
+
+def generate_company_description(company_domain: str, use_cache: bool = True) -> str:
+    """Summary of a company's website; ``use_cache=False`` scrapes the site again as well"""
+    description = get_company_description(company_domain, use_cache=use_cache)
 
     response = make_completion_request(
         model="gpt-3.5-turbo",
-        messages=[{"role": "user", "content": prompt}],
+        messages=_company_description_messages(company_domain, description),
         max_tokens=150,
-        temperature=0.5
+        temperature=0.5,
+        use_cache=use_cache
         )
     return response
 
 
-def generate_standard_response(lead_info, previous_conversation):
+async def generate_company_description_async(company_domain: str, use_cache: bool = True) -> str:
+    description = await get_company_description_async(company_domain, use_cache=use_cache)
+    return await make_completion_request_async(
+        model="gpt-3.5-turbo",
+        messages=_company_description_messages(company_domain, description),
+        max_tokens=150,
+        temperature=0.5,
+        use_cache=use_cache
+    )
+
+
+def _standard_response_messages(lead_info, previous_conversation) -> list[dict]:
+    if isinstance(lead_info, dict):
+        lead_info = lead_prompt_info(lead_info, Config.PROMPT_LEAD_INFO_TOKENS)
+    previous_conversation = trim_history(previous_conversation, Config.PROMPT_HISTORY_TOKENS)
     prompt = (
         f"Generate a response email based on the following conversation and lead info:\n\n{previous_conversation}\n\n and Lead INFO: {lead_info}"
         "The response should be polite, engaging, and should focus on building rapport. Do not reference agency info or services."
     )
+    return [{"role": "user", "content": prompt}]
+
 
+def generate_standard_response(lead_info, previous_conversation, use_cache: bool = False):
     response = make_completion_request(
         model="gpt-3.5-turbo",
-        messages=[{"role": "user", "content": prompt}],
+        messages=_standard_response_messages(lead_info, previous_conversation),
         max_tokens=150,
-        temperature=0.7
+        temperature=0.7,
+        use_cache=use_cache
     )
 
     return response
 
 
-def extract_email_conversation(email_body: str) -> str:
+def _email_conversation_messages(email_body: str) -> list[dict]:
+    # The newest message comes first, older quoted ones after it
+    email_body = truncate_tokens(email_body, Config.PROMPT_EMAIL_BODY_TOKENS)
     prompt = (
         f"Extract the email conversation and format it as a Python dictionary of dictionaries where:\n"
         "The outer dictionary has keys as the timestamp of the message and values as dictionary with the following keys:\n"
@@ -133,7 +341,23 @@ def extract_email_conversation(email_body: str) -> str:
         f"Email body:\n{email_body}\n\n"
         "Return ONLY a valid Python dictionary of dictionaries with the conversation.\n"
     )
-    return dict(json.loads(make_completion_request(
+    return [{"role": "user", "content": prompt}]
+
+
+def email_conversation_request(email_body: str) -> dict:
+    """The completion request extract_email_conversation_async makes, e.g. for a batch job"""
+    return _completion_kwargs(_email_conversation_messages(email_body), "gpt-3.5-turbo", 0.3, None)
+
+
+async def extract_email_conversation_async(email_body: str, use_cache: bool = True) -> dict:
+    return dict(json.loads(await make_completion_request_async(
         model="gpt-3.5-turbo",
-        messages=[{"role": "user", "content": prompt}],
+        messages=_email_conversation_messages(email_body),
+        use_cache=use_cache,
+        validate=json.loads,
     )))
+
+
+def extract_email_conversations(email_bodies: list[str]) -> list:
+    """extract_email_conversation_async for many emails at once; failed extractions are returned as exceptions"""
+    return run_concurrently([extract_email_conversation_async(body) for body in email_bodies])
@@ -0,0 +1,20 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# config.py reads these at import; keep every local store the tests touch in a scratch directory
+SCRATCH = tempfile.mkdtemp(prefix="outreach-tests-")
+os.environ.setdefault("SPREADSHEET_ID", "test-spreadsheet")
+os.environ.setdefault("STARTING_ROW", "2")
+os.environ.setdefault("EMAIL_CONFIG_FILE", os.path.join(SCRATCH, "emails.ini"))
+os.environ["LEADS_BACKEND"] = "sheet"
+os.environ["LLM_BATCH_DIR"] = os.path.join(SCRATCH, "llm_batches")
+for name, filename in [
+    ("LLM_CACHE_DB", "llm_cache.db"),
+    ("MAILBOX_STATE_DB", "mailbox_state.db"),
+    ("SCRAPER_CACHE_DB", "page_cache.db"),
+    ("LEADS_DB_PATH", "leads.db"),
+]:
+    os.environ[name] = os.path.join(SCRATCH, filename)
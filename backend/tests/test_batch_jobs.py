@@ -0,0 +1,150 @@
+import json
+import pytest
+from config import Config
+from constants import EmailStatus, SheetColumns
+from connectors import batch_jobs
+from connectors.batch_jobs import BatchJobRunner, LocalBatchProvider
+
+EMAIL = SheetColumns.EMAIL.value
+DOMAIN = SheetColumns.COMPANY_DOMAIN.value
+BACKGROUND = SheetColumns.COMPANY_BACKGROUND.value
+STATUS = SheetColumns.EMAIL_STATUS.value
+
+
+class FakeSheet:
+    """Leads kept in memory, read and written the way the runner uses the repository"""
+
+    def __init__(self, leads: list[dict]):
+        self.leads = {lead[EMAIL]: dict(lead) for lead in leads}
+        self.writes = []
+
+    def read(self) -> list[dict]:
+        return [dict(lead) for lead in self.leads.values()]
+
+    def write(self, updates: dict[str, dict]) -> None:
+        if updates:
+            self.writes.append(updates)
+        for email, update in updates.items():
+            self.leads[email].update(update)
+
+
+@pytest.fixture
+def sheet(monkeypatch, tmp_path):
+    sheet = FakeSheet([
+        {EMAIL: "ann@acme.test", DOMAIN: "acme.test", BACKGROUND: "", STATUS: EmailStatus.NEW.value},
+        {EMAIL: "bob@globex.test", DOMAIN: "globex.test", BACKGROUND: "", STATUS: EmailStatus.SENT.value},
+        {EMAIL: "cy@initech.test", DOMAIN: "initech.test", BACKGROUND: "Already known", STATUS: EmailStatus.NEW.value},
+        {EMAIL: "di@umbrella.test", DOMAIN: "umbrella.test", BACKGROUND: "", STATUS: EmailStatus.FAILED.value},
+    ])
+    sheet.scraped = []
+
+    def describe(domains):
+        sheet.scraped.extend(domains)
+        return iter([(domain, f"Homepage text of {domain}", None) for domain in domains])
+
+    monkeypatch.setattr(batch_jobs, "get_leads_data", sheet.read)
+    monkeypatch.setattr(batch_jobs, "write_lead_updates", sheet.write)
+    monkeypatch.setattr(batch_jobs, "iter_company_descriptions", describe)
+    monkeypatch.setattr(batch_jobs.MAILBOX_STATE, "leads_with_messages", lambda: [])
+    monkeypatch.setattr(Config, "LLM_BATCH_DIR", str(tmp_path / "batches"))
+    monkeypatch.setattr(Config, "LLM_CACHE", False)
+    return sheet
+
+
+def make_runner(tmp_path, complete) -> BatchJobRunner:
+    """A runner as the app builds it after a (re)start: a fresh provider over the same files"""
+    provider = LocalBatchProvider(str(tmp_path / "batches"), complete=complete)
+    return BatchJobRunner(provider, state_path=str(tmp_path / "batches" / "state.json"))
+
+
+def summarize(body: dict) -> str:
+    prompt = body["messages"][-1]["content"]
+    domain = prompt.split("homepage of ", 1)[1].split(":", 1)[0]
+    return f"Summary of {domain}"
+
+
+def no_completions(body: dict) -> str:
+    raise AssertionError("Nothing should be sent to the provider")
+
+
+def test_submitted_job_is_written_back_after_restart(sheet, tmp_path):
+    report = make_runner(tmp_path, summarize).run_once()
+
+    assert report["submitted"] is not None
+    assert sorted(sheet.scraped) == ["acme.test", "globex.test"]
+    assert sheet.writes == []
+
+    # A new process picks the job up from the state file instead of submitting the leads again
+    report = make_runner(tmp_path, no_completions).run_once()
+
+    assert list(report["written"].values()) == [2]
+    assert report["submitted"] is None
+    assert sheet.leads["ann@acme.test"][BACKGROUND] == "Summary of acme.test"
+    assert sheet.leads["bob@globex.test"][BACKGROUND] == "Summary of globex.test"
+    assert sheet.leads["cy@initech.test"][BACKGROUND] == "Already known"
+    assert sheet.leads["di@umbrella.test"][BACKGROUND] == ""
+    assert make_runner(tmp_path, no_completions).status() == {"jobs": []}
+
+    report = make_runner(tmp_path, no_completions).run_once()
+    assert report == {"written": {}, "running": [], "submitted": None}
+    assert len(sheet.writes) == 1
+
+
+def test_job_is_recorded_before_upload_and_uploaded_after_restart(sheet, tmp_path, monkeypatch):
+    def interrupted(path):
+        raise OSError("upload interrupted")
+
+    runner = make_runner(tmp_path, summarize)
+    monkeypatch.setattr(runner.provider, "submit", interrupted)
+    with pytest.raises(OSError):
+        runner.run_once()
+
+    jobs = make_runner(tmp_path, summarize).status()["jobs"]
+    assert len(jobs) == 1 and jobs[0]["batch_id"] is None
+    assert jobs[0]["leads"] == ["ann@acme.test", "bob@globex.test"]
+
+    scraped = len(sheet.scraped)
+    report = make_runner(tmp_path, summarize).run_once()
+    assert report["running"] == [jobs[0]["id"]]
+    assert report["submitted"] is None
+    # The recorded leads were not scraped or requested a second time
+    assert len(sheet.scraped) == scraped
+
+    report = make_runner(tmp_path, no_completions).run_once()
+    assert report["written"] == {jobs[0]["id"]: 2}
+    assert sheet.leads["ann@acme.test"][BACKGROUND] == "Summary of acme.test"
+
+
+def test_write_back_keeps_values_filled_in_meanwhile(sheet, tmp_path):
+    make_runner(tmp_path, summarize).run_once()
+    sheet.leads["ann@acme.test"][BACKGROUND] = "Written by hand"
+
+    make_runner(tmp_path, no_completions).run_once()
+
+    assert sheet.leads["ann@acme.test"][BACKGROUND] == "Written by hand"
+    assert sheet.leads["bob@globex.test"][BACKGROUND] == "Summary of globex.test"
+
+
+def test_malformed_results_only_lose_their_own_request(sheet, tmp_path):
+    def answer(content):
+        return {"status_code": 200, "body": {"choices": [{"message": {"content": content}}]}}
+
+    job = {"requests": {
+        "description:ann@acme.test": {"lead": "ann@acme.test", "body": {}},
+        "description:bob@globex.test": {"lead": "bob@globex.test", "body": {}},
+        "extraction:ann@acme.test:<1@acme.test>": {"lead": "ann@acme.test", "body": {}},
+        "extraction:bob@globex.test:<2@globex.test>": {"lead": "bob@globex.test", "body": {}},
+    }}
+    results = [
+        {"custom_id": "description:ann@acme.test", "response": {"status_code": 200, "body": {"choices": []}}},
+        {"custom_id": "description:bob@globex.test", "response": answer("Summary of globex.test")},
+        {"custom_id": "extraction:ann@acme.test:<1@acme.test>", "response": answer("[1, 2]")},
+        {"custom_id": "extraction:bob@globex.test:<2@globex.test>",
+         "response": answer(json.dumps({"2024-01-02 10:00:00": {"message": "Sounds good"}}))},
+    ]
+    leads = {lead[EMAIL]: lead for lead in sheet.read()}
+
+    written = make_runner(tmp_path, no_completions)._write_back(job, results, leads)
+
+    assert written == 1
+    assert sheet.writes == [{"bob@globex.test": {BACKGROUND: "Summary of globex.test"}}]
@@ -0,0 +1,214 @@
+import re
+import html
+from datetime import datetime, timedelta, timezone
+from email.message import Message
+from email.utils import parseaddr, parsedate_to_datetime
+from zoneinfo import ZoneInfo
+
+# The sheet stores conversation timestamps as Asia/Kolkata wall-clock time
+SHEET_TIMEZONE = ZoneInfo("Asia/Kolkata")
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+ADDRESS = re.compile(r'[\w.+-]+@[\w-]+(?:\.[\w-]+)+')
+TIME = r'\d{1,2}[:.]\d{2}(?:[:.]\d{2})?\s*(?:[AaPp]\.?\s?[Mm]\.?)?(?:\s*(?:GMT|UTC)?\s*[+-]\d{2}:?\d{2}|\s+[A-Z]{2,5}\b)?'
+# "On Mon, Jan 1, 2024 at 10:00 AM John <john@x.com> wrote:" and the Apple Mail / localised variants
+ATTRIBUTION = re.compile(rf'^\s*On\s+(?P<date>.*?{TIME}),?\s+(?P<author>.*?)\s+wrote:\s*$', re.IGNORECASE | re.DOTALL)
+OUTLOOK_SEPARATOR = re.compile(r'^\s*-{2,}\s*(Original Message|Forwarded message)\s*-{2,}\s*$', re.IGNORECASE)
+OUTLOOK_HEADER = re.compile(r'^\s*\*?(From|Sent|Date|To|Cc|Subject)\s*:\*?\s*(.*)$', re.IGNORECASE)
+SIGNATURE = re.compile(r'^\s*(--\s*|_{3,}|Sent from my .+|Get Outlook for .+|Sent from (Mail|Yahoo Mail|Outlook) .*)$', re.IGNORECASE)
+TAG = re.compile(r'<[^>]*>')
+BLOCK_END = re.compile(r'<\s*(br|/p|/div|/tr|/li)\b[^>]*>', re.IGNORECASE)
+WEEKDAY = re.compile(r'\b(Mon|Tue|Wed|Thu|Fri|Sat|Sun)[a-z]*\.?,?\s*', re.IGNORECASE)
+
+DATE_FORMATS = [
+    f"{date} {time}"
+    for date in ("%b %d %Y", "%B %d %Y", "%d %b %Y", "%d %B %Y", "%Y-%m-%d", "%d/%m/%Y", "%m/%d/%Y", "%d.%m.%Y")
+    for time in ("%I:%M %p", "%I:%M:%S %p", "%H:%M", "%H:%M:%S")
+]
+ZONE_NAMES = {'UTC': timezone.utc, 'GMT': timezone.utc, 'IST': SHEET_TIMEZONE}
+
+# Confidence lost for each problem found while parsing
+MISSING_TIMESTAMP = 0.5
+MISSING_SENDER = 0.5
+UNATTRIBUTED_QUOTE = 0.5
+EMPTY_MESSAGE = 0.3
+ASSUMED_TIMEZONE = 0.1
+
+
+def html_to_text(text: str) -> str:
+    return html.unescape(TAG.sub('', BLOCK_END.sub('\n', text)))
+
+
+def decode_body(message: Message) -> str:
+    """Text of a message, preferring text/plain and decoding transfer encoding and charset"""
+    if message.is_multipart():
+        parts = [
+            part for part in message.walk()
+            if part.get_content_maintype() == 'text' and part.get_content_disposition() != 'attachment'
+        ]
+        part = next((part for part in parts if part.get_content_subtype() == 'plain'), parts[0] if parts else None)
+        return decode_body(part) if part is not None else ''
+
+    payload = message.get_payload()
+    if isinstance(payload, str) and message.get('Content-Transfer-Encoding') is None:
+        text = payload  # Already decoded, e.g. the capped bodies from imap_fetch
+    else:
+        raw = message.get_payload(decode=True) or b''
+        try:
+            text = raw.decode(message.get_content_charset() or 'utf-8', 'replace')
+        except LookupError:
+            text = raw.decode('utf-8', 'replace')
+    return html_to_text(text) if message.get_content_subtype() == 'html' else text
+
+
+def to_sheet_timestamp(value: datetime) -> str:
+    """Format a datetime as the sheet's Asia/Kolkata timestamp; naive values are taken as Kolkata time"""
+    if value.tzinfo is not None:
+        value = value.astimezone(SHEET_TIMEZONE)
+    return value.strftime(TIMESTAMP_FORMAT)
+
+
+def parse_date(value: str) -> tuple[datetime | None, bool]:
+    """(datetime, has timezone) for an RFC 2822 date or a mail client's quote attribution date"""
+    try:
+        parsed = datetime.fromisoformat(value.strip())
+        return parsed, parsed.tzinfo is not None
+    except ValueError:
+        pass
+
+    text = WEEKDAY.sub('', value)
+    text = re.sub(r'\bat\b|,', ' ', text)
+    text = re.sub(r'([AaPp])\.?\s?[Mm]\.?', r'\1M', text)
+    text = re.sub(r'(\d{1,2})\.(\d{2})(?=\s|$|[:.])', r'\1:\2', text)
+
+    tzinfo = None
+    if offset := re.search(r'(?:GMT|UTC)?\s*([+-])(\d{2}):?(\d{2})\s*$', text):
+        sign = 1 if offset.group(1) == '+' else -1
+        tzinfo = timezone(sign * timedelta(hours=int(offset.group(2)), minutes=int(offset.group(3))))
+        text = text[:offset.start()]
+    elif (zone := re.search(r'\b([A-Z]{2,5})\s*$', text)) and zone.group(1) in ZONE_NAMES:
+        tzinfo = ZONE_NAMES[zone.group(1)]
+        text = text[:zone.start()]
+
+    text = ' '.join(re.sub(r'(\d)(st|nd|rd|th)\b', r'\1', text).split())
+    for date_format in DATE_FORMATS:
+        try:
+            parsed = datetime.strptime(text, date_format)
+        except ValueError:
+            continue
+        return (parsed.replace(tzinfo=tzinfo), True) if tzinfo else (parsed, False)
+
+    # Last resort, as it silently ignores AM/PM
+    try:
+        parsed = parsedate_to_datetime(value)
+        return parsed, parsed.tzinfo is not None
+    except (TypeError, ValueError, IndexError):
+        return None, False
+
+
+def strip_signature(lines: list[str]) -> list[str]:
+    for i, line in enumerate(lines):
+        if SIGNATURE.match(line):
+            return lines[:i]
+    return lines
+
+
+def unquote(lines: list[str]) -> list[str]:
+    """Remove one level of "> " quoting"""
+    return [re.sub(r'^\s?>\s?', '', line) for line in lines]
+
+
+def _find_attribution(lines: list[str]) -> tuple[int, int, str, str] | None:
+    """(first line, line after, date, author) of the first quote attribution"""
+    for i in range(len(lines)):
+        if OUTLOOK_SEPARATOR.match(lines[i]) or (OUTLOOK_HEADER.match(lines[i]) and OUTLOOK_HEADER.match(lines[i]).group(1).lower() == 'from'):
+            fields, end = {}, i + (1 if OUTLOOK_SEPARATOR.match(lines[i]) else 0)
+            while end < len(lines) and (header := OUTLOOK_HEADER.match(lines[end])):
+                fields[header.group(1).lower()] = header.group(2)
+                end += 1
+            if 'from' in fields and ('sent' in fields or 'date' in fields):
+                return i, end, fields.get('sent') or fields.get('date'), fields['from']
+        if re.match(r'^\s*(>\s*)?On\s', lines[i], re.IGNORECASE):
+            # Clients wrap long attributions over a couple of lines
+            for end in range(i + 1, min(i + 4, len(lines)) + 1):
+                joined = ' '.join(line.strip().lstrip('>').strip() for line in lines[i:end])
+                if match := ATTRIBUTION.match(joined):
+                    return i, end, match.group('date'), match.group('author')
+    return None
+
+
+def parse_message_text(text: str, sender: str, date: str) -> list[dict]:
+    """Split one email body into its own message followed by every quoted earlier message
+
+    Each entry is {"timestamp", "sender", "message", "confidence"}: the timestamp
+    a datetime, and the confidence between 0 and 1 that the entry is complete
+    and correctly attributed. Entries whose sender or timestamp could not be
+    found are kept with None so callers can account for them.
+    """
+    entries = []
+    lines = text.replace('\r\n', '\n').split('\n')
+    author, when = sender, date
+
+    while True:
+        confidence = 1.0
+        attribution = _find_attribution(lines)
+        own = lines[:attribution[0]] if attribution else lines
+        if any(line.lstrip().startswith('>') for line in own):
+            # Quoted text without an attribution line we understand
+            own = [line for line in own if not line.lstrip().startswith('>')]
+            confidence -= UNATTRIBUTED_QUOTE
+
+        message = '\n'.join(strip_signature(own)).strip()
+        address = ADDRESS.search(parseaddr(author)[1] or author or '')
+        timestamp, has_zone = parse_date(when) if when else (None, False)
+        if not message:
+            confidence -= EMPTY_MESSAGE
+        if address is None:
+            confidence -= MISSING_SENDER
+        if timestamp is None:
+            confidence -= MISSING_TIMESTAMP
+        elif not has_zone:
+            confidence -= ASSUMED_TIMEZONE
+        entries.append({
+            'timestamp': timestamp,
+            'sender': address.group(0).lower() if address else None,
+            'message': message,
+            'confidence': max(confidence, 0.0),
+        })
+
+        if not attribution:
+            return entries
+        _, end, when, author = attribution
+        quoted = lines[end:]
+        lines = unquote(quoted) if any(line.lstrip().startswith('>') for line in quoted) else quoted
+
+
+def parse_thread(messages: list[dict]) -> tuple[dict, float]:
+    """Conversation of a thread in the sheet format, and the parser's confidence in it
+
+    ``messages`` are cached message records (sender, date, body) in date order.
+    Each message contributes its own text; the quoted history of the latest
+    message fills in messages we never cached, such as our own sent emails.
+    The result maps "YYYY-MM-DD HH:MM:SS" Asia/Kolkata timestamps to
+    {"sender": address, "message": text}, oldest first. The confidence is
+    that of the least certain entry used.
+    """
+    if not messages:
+        return {}, 0.0
+
+    entries = []
+    for i, record in enumerate(messages):
+        parsed = parse_message_text(record['body'], record['sender'], record['date'])
+        # Older messages' quoted history is repeated in the latest one
+        entries.extend(parsed if i == len(messages) - 1 else parsed[:1])
+
+    conversation, seen = {}, set()
+    complete = [entry for entry in entries if entry['timestamp'] and entry['sender'] and entry['message']]
+    for entry in sorted(complete, key=lambda entry: to_sheet_timestamp(entry['timestamp'])):
+        timestamp = to_sheet_timestamp(entry['timestamp'])
+        # Quote attributions carry minutes only, so a cached message may also appear quoted
+        if (entry['sender'], timestamp[:16]) in seen:
+            continue
+        seen.add((entry['sender'], timestamp[:16]))
+        conversation[timestamp] = {'sender': entry['sender'], 'message': entry['message']}
+    return conversation, min(entry['confidence'] for entry in entries)
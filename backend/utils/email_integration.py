@@ -2,6 +2,7 @@ import json
 import re
 import requests
 from datetime import datetime
+from email.utils import make_msgid
 from config import Config
 
 class EmailDeliveryError(Exception):
@@ -66,13 +67,16 @@ def send_email(from_email: str, to_email: str, subject: str, html_content: str,
     request_id = f"email_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
     clean_subject = subject.strip().strip('"\'').strip()
     from_email_complete = f"{sender_config['display_name']} <{from_email}>"
+    # Our own Message-ID, so replies can be matched to the lead by In-Reply-To / References
+    message_id = make_msgid(domain=from_email.rsplit('@', 1)[-1])
 
     email_data = {
         "from": from_email_complete,
         "to": to_email,
         "subject": clean_subject,
         "html": html_content,
-        "attachments": attachments or []
+        "attachments": attachments or [],
+        "headers": {"Message-ID": message_id}
     }
 
     if not sender_config:
@@ -107,6 +111,7 @@ def send_email(from_email: str, to_email: str, subject: str, html_content: str,
         "status": "success",
         "request_id": request_id,
         "email_id": response_data.get('id'),
+        "message_id": message_id,
         "details": {
             "from": from_email,
             "from_email_complete": from_email_complete,
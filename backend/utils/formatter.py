@@ -1,38 +1,95 @@
+import json
+from typing import Iterable, Iterator
 from constants import SheetColumns
 
 
+def format_lead_keys(lead: dict) -> dict:
+    return {k.lower().replace(' ', '_'): v for k, v in lead.items()}
+
+
 def format_keys(data: list[dict]) -> list[dict]:
-    return [{k.lower().replace(' ', '_'): v for k, v in lead.items()} for lead in data]
+    return [format_lead_keys(lead) for lead in data]
+
+
+def stream_json_array(items: Iterable, prefix: str = '', suffix: str = '') -> Iterator[str]:
+    """Serialise ``items`` as a JSON array one element at a time, for chunked responses"""
+    yield prefix + '['
+    for i, item in enumerate(items):
+        yield (',' if i else '') + json.dumps(item)
+    yield ']' + suffix
+
+
+def format_sse(event: str, data) -> str:
+    """One Server-Sent Events message carrying ``data`` as JSON"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+# The subject line is only ever filled in with these, like the prompt asks
+SUBJECT_PLACEHOLDERS = ('role', 'company')
+
+
+def email_placeholder_values(lead: dict, agency_info: dict) -> dict:
+    """Values for every placeholder the cold email prompt allows"""
+    return {
+        'recipient_name': lead[SheetColumns.NAME.value],
+        'role': lead[SheetColumns.ROLE.value],
+        'company': lead[SheetColumns.COMPANY_NAME.value],
+        'agency_name': agency_info['Agency Name'],
+        'agency_info': agency_info['Agency Info'],
+        'sender_name': agency_info['Sender Name'],
+        'sender_position': agency_info['Sender Position'],
+        'agency_website': agency_info['Agency Website'],
+        'company_description': lead.get(SheetColumns.COMPANY_BACKGROUND.value, ''),
+    }
+
+
+def subject_placeholder_values(values: dict) -> dict:
+    return {name: values[name] for name in SUBJECT_PLACEHOLDERS}
 
 
 def format_email_content(email_content: dict, lead: dict, agency_info: dict) -> dict:
     """Format email content by replacing placeholders with actual values."""
-    
-    email_body = email_content['email']
-    email_subject = email_content['subject']
-
-    # Extract agency info
-    agency_name = agency_info['Agency Name']
-    sender_name = agency_info['Sender Name']
-    sender_position = agency_info['Sender Position']
-    agency_description = agency_info['Agency Info']
-    agency_website = agency_info['Agency Website']
-    
+    values = email_placeholder_values(lead, agency_info)
     return {
-        'subject': email_subject.format(
-            role=lead[SheetColumns.ROLE.value],
-            company=lead[SheetColumns.COMPANY_NAME.value],
-        ),
-        'email': email_body.format(
-            recipient_name=lead[SheetColumns.NAME.value],
-            role=lead[SheetColumns.ROLE.value],
-            company=lead[SheetColumns.COMPANY_NAME.value],
-            agency_name=agency_name,
-            agency_info=agency_description,
-            sender_name=sender_name,
-            sender_position=sender_position,
-            agency_website=agency_website,
-            company_description=lead.get(SheetColumns.COMPANY_BACKGROUND.value, '')
-        )
+        'subject': email_content['subject'].format(**subject_placeholder_values(values)),
+        'email': email_content['email'].format(**values),
     }
 
+
+class PlaceholderStream:
+    """Replaces ``{placeholder}``s in text that arrives in pieces.
+
+    Text is passed through as soon as it can't be part of a placeholder; a
+    ``{`` is held back until its closing brace arrives. Unknown placeholders,
+    or braces left open for more than ``max_name`` characters, are passed
+    through unchanged.
+    """
+
+    def __init__(self, values: dict, max_name: int = 40):
+        self.values = values
+        self.max_name = max_name
+        self._held = ''
+
+    def feed(self, text: str) -> str:
+        out = []
+        for char in text:
+            if self._held:
+                self._held += char
+                if char == '}':
+                    name = self._held[1:-1]
+                    out.append(str(self.values[name]) if name in self.values else self._held)
+                    self._held = ''
+                elif char == '{' or len(self._held) > self.max_name + 2:
+                    out.append(self._held[:-1])
+                    self._held = char if char == '{' else ''
+                    if char != '{':
+                        out.append(char)
+            elif char == '{':
+                self._held = char
+            else:
+                out.append(char)
+        return ''.join(out)
+
+    def flush(self) -> str:
+        held, self._held = self._held, ''
+        return held
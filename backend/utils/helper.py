@@ -1,16 +1,21 @@
 import re
 import json
-from constants import SheetColumns
-from openai_llm import generate_company_description
-from connectors.gsheet import get_lead_by_email, update_sheet_row
+from typing import Iterator
+from concurrent.futures import as_completed
+from config import Config
+from constants import EmailStatus, SheetColumns
+from utils.formatter import format_email_content
+from openai_llm import generate_company_description, generate_company_description_async, generate_1st_cold_email_content_async, submit
+from connectors.repository import get_lead_by_email, queue_sheet_update, update_sheet_rows
 
 
 def update_description(email: str, description: str) -> bool:
-    """Update company description in the sheet"""
-    return update_sheet_row(
+    """Queue the company description update for the sheet"""
+    queue_sheet_update(
         email,
         {SheetColumns.COMPANY_BACKGROUND.value: description}
     )
+    return True
 
 
 def get_description(email: str) -> dict:
@@ -32,6 +37,120 @@ def get_description(email: str) -> dict:
     return {"success": True, "description": new_description} if update_description(email, new_description) else {"success": False, "error": "Failed to update description"}
 
 
+SEARCHABLE_COLUMNS = (
+    SheetColumns.NAME.value,
+    SheetColumns.EMAIL.value,
+    SheetColumns.COMPANY_NAME.value,
+    SheetColumns.COMPANY_DOMAIN.value,
+    SheetColumns.ROLE.value,
+)
+
+
+def lead_matches(lead: dict, statuses: set[str] | None = None, sender: str | None = None, search: str | None = None) -> bool:
+    """Whether a lead passes the status (case-insensitive), sender email and free-text filters"""
+    status = lead.get(SheetColumns.EMAIL_STATUS.value) or EmailStatus.NEW.value
+    if statuses is not None and status.lower() not in statuses:
+        return False
+    if sender and lead.get(SheetColumns.SENDER_EMAIL.value, '').lower() != sender.lower():
+        return False
+    if search:
+        haystack = ' '.join(str(lead.get(col, '')) for col in SEARCHABLE_COLUMNS).lower()
+        if search.lower() not in haystack:
+            return False
+    return True
+
+
+def paginate_leads(leads: list[dict], cursor: int = 0, limit: int | None = None, **filters) -> tuple[list[int], int | None]:
+    """Positions of the matching leads on this page, and the cursor of the next page
+
+    The cursor is a position in sheet order, so it stays valid while rows are only appended.
+    """
+    if cursor < 0 or (limit is not None and limit < 1):
+        raise ValueError("cursor must be >= 0 and limit >= 1")
+    positions = []
+    for position in range(max(cursor, 0), len(leads)):
+        if not lead_matches(leads[position], **filters):
+            continue
+        if limit is not None and len(positions) == limit:
+            return positions, position
+        positions.append(position)
+    return positions, None
+
+
+def write_lead_updates(updates: dict[str, dict]):
+    """Write updates for many leads in one batch, queueing them if the batch fails"""
+    if not updates:
+        return
+    try:
+        update_sheet_rows(updates)
+    except Exception as e:
+        print(f"Batched lead update failed, queueing instead: {e}")
+        for lead_email, data in updates.items():
+            queue_sheet_update(lead_email, data)
+
+
+def select_leads_in_rows(leads: list[dict], rows: dict[str, int], starting_row: int, ending_row: int = 0, **filters) -> list[dict]:
+    """Leads on sheet rows ``starting_row`` to ``ending_row`` (0 for the last row) passing lead_matches
+
+    ``rows`` maps each lead's email to its sheet row, as the lead store reports it.
+    """
+    return [
+        lead for lead in leads
+        if (row := rows.get(lead.get(SheetColumns.EMAIL.value))) is not None
+        and starting_row <= row and (not ending_row or row <= ending_row)
+        and lead_matches(lead, **filters)
+    ]
+
+
+async def _generate_cold_email(lead: dict, agency_info: dict, use_cache: bool) -> dict:
+    """The sheet update holding a lead's generated cold email, plus its company description if it had none"""
+    update = {}
+    if not (description := lead.get(SheetColumns.COMPANY_BACKGROUND.value)):
+        if not (company_domain := lead.get(SheetColumns.COMPANY_DOMAIN.value)):
+            raise ValueError("Company domain not found")
+        description = update[SheetColumns.COMPANY_BACKGROUND.value] = await generate_company_description_async(company_domain)
+        lead = {**lead, SheetColumns.COMPANY_BACKGROUND.value: description}
+
+    email_content = await generate_1st_cold_email_content_async(lead, agency_info, description, use_cache=use_cache)
+    formatted_content = format_email_content(email_content, lead, agency_info)
+    update[SheetColumns.COLD_EMAIL_SUBJECT.value] = formatted_content['subject']
+    update[SheetColumns.EMAIL_CONTENT.value] = formatted_content['email']
+    return update
+
+
+def generate_cold_emails(leads: list[dict], agency_info: dict, use_cache: bool = False,
+                         batch_size: int = Config.BULK_WRITE_BATCH) -> Iterator[tuple[str, dict | None, Exception | None]]:
+    """Generate cold emails for many leads concurrently, yielding (lead email, update, error) as each finishes
+
+    Concurrency and request rate are bounded by the shared OpenAI budget.
+    Results are written to the sheet every ``batch_size`` leads; if the
+    consumer stops early, unfinished leads are cancelled and finished ones
+    are still written.
+    """
+    futures = {
+        submit(_generate_cold_email(lead, agency_info, use_cache)): lead[SheetColumns.EMAIL.value]
+        for lead in leads
+    }
+    pending = {}
+    try:
+        for future in as_completed(futures):
+            lead_email = futures[future]
+            try:
+                update = future.result()
+            except Exception as e:
+                yield lead_email, None, e
+                continue
+            pending[lead_email] = update
+            if len(pending) >= batch_size:
+                write_lead_updates(pending)
+                pending = {}
+            yield lead_email, update, None
+    finally:
+        for future in futures:
+            future.cancel()
+        write_lead_updates(pending)
+
+
 def clean_json_string(s: str) -> str:
     return re.sub(r"'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})'", r'"\1"', s).encode('utf-8').decode('unicode_escape').replace('\r', '').replace('\n', '{newline}').replace('\t', '{tab}')
 
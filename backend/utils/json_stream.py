@@ -0,0 +1,101 @@
+ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f', '"': '"', '\\': '\\', '/': '/'}
+
+
+class JSONFieldStream:
+    """Incrementally decodes the string fields of a JSON object arriving in chunks.
+
+    Built for streamed completions like ``{"subject": "...", "email": "..."}``:
+    ``feed`` returns the newly decoded text of each top-level string field as
+    soon as it arrives, so it can be shown before the object is complete.
+    Text before the opening brace (e.g. a Markdown code fence) is ignored;
+    non-string values are skipped.
+    """
+
+    def __init__(self):
+        self._state = 'start'
+        self._key = ''
+        self._field = None
+        self._unicode = ''
+        self._high_surrogate = None
+
+    def feed(self, chunk: str) -> list[tuple[str, str]]:
+        """(field, text) pieces decoded from ``chunk``, consecutive pieces of a field merged"""
+        pieces = []
+
+        def emit(text: str):
+            if pieces and pieces[-1][0] == self._field:
+                pieces[-1] = (self._field, pieces[-1][1] + text)
+            else:
+                pieces.append((self._field, text))
+
+        for char in chunk:
+            state = self._state
+            if state == 'start':
+                if char == '{':
+                    self._state = 'object'
+            elif state == 'object':
+                if char == '"':
+                    self._key, self._state = '', 'key'
+                elif char == '}':
+                    self._state = 'end'
+            elif state in ('key', 'key_escape'):
+                if state == 'key_escape':
+                    self._key += ESCAPES.get(char, char)
+                    self._state = 'key'
+                elif char == '\\':
+                    self._state = 'key_escape'
+                elif char == '"':
+                    self._state = 'colon'
+                else:
+                    self._key += char
+            elif state == 'colon':
+                if char == ':':
+                    self._state = 'value'
+            elif state == 'value':
+                if char == '"':
+                    self._field, self._state = self._key, 'string'
+                elif not char.isspace():
+                    self._state = 'scalar'
+            elif state == 'scalar':
+                if char == ',':
+                    self._state = 'object'
+                elif char == '}':
+                    self._state = 'end'
+            elif state == 'string':
+                if char == '\\':
+                    self._state = 'escape'
+                elif char == '"':
+                    self._state = 'object'
+                else:
+                    emit(char)
+            elif state == 'escape':
+                if char == 'u':
+                    self._unicode, self._state = '', 'unicode'
+                else:
+                    emit(ESCAPES.get(char, char))
+                    self._state = 'string'
+            elif state == 'unicode':
+                self._unicode += char
+                if len(self._unicode) == 4:
+                    self._state = 'string'
+                    try:
+                        text = self._decode_code_unit(int(self._unicode, 16))
+                    except ValueError:
+                        text = '\\u' + self._unicode
+                    if text:
+                        emit(text)
+        return pieces
+
+    def _decode_code_unit(self, code: int) -> str:
+        """Decode one \\uXXXX escape, pairing UTF-16 surrogates"""
+        if 0xD800 <= code <= 0xDBFF:
+            self._high_surrogate = code
+            return ''
+        if 0xDC00 <= code <= 0xDFFF and self._high_surrogate is not None:
+            code = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+        self._high_surrogate = None
+        return chr(code)
+
+    @property
+    def complete(self) -> bool:
+        return self._state == 'end'
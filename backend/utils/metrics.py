@@ -0,0 +1,42 @@
+import threading
+from collections import Counter, deque
+
+
+class Metrics:
+    """Thread-safe in-process counters, exposed by the /api/metrics endpoint"""
+
+    def __init__(self, history: int = 100):
+        self._lock = threading.Lock()
+        self._counters = Counter()
+        self._events = {}
+        self._history = history
+
+    def incr(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += amount
+
+    def get(self, name: str) -> int:
+        with self._lock:
+            return self._counters[name]
+
+    def ratio(self, name: str, *names: str) -> float | None:
+        """``name`` as a fraction of the sum of ``names``, or None before any are counted"""
+        with self._lock:
+            total = sum(self._counters[other] for other in names)
+            return self._counters[name] / total if total else None
+
+    def record(self, name: str, event: dict) -> None:
+        """Keep ``event`` among the latest ``history`` events of its kind"""
+        with self._lock:
+            self._events.setdefault(name, deque(maxlen=self._history)).append(event)
+
+    def recent(self, name: str) -> list[dict]:
+        with self._lock:
+            return list(self._events.get(name, ()))
+
+    def snapshot(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+
+METRICS = Metrics()
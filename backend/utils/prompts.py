@@ -0,0 +1,93 @@
+import math
+from constants import SheetColumns
+
+try:
+    import tiktoken
+except ImportError:  # Fall back to estimating from the text length
+    tiktoken = None
+
+# Characters per token when tiktoken isn't installed; close for English text
+CHARS_PER_TOKEN = 4
+# Tokens the chat format adds around every message
+MESSAGE_OVERHEAD = 4
+
+# The lead fields worth giving the model; the rest are long HTML, history or bookkeeping
+LEAD_PROMPT_FIELDS = (
+    SheetColumns.NAME.value,
+    SheetColumns.ROLE.value,
+    SheetColumns.HEADLINE.value,
+    SheetColumns.COMPANY_NAME.value,
+    SheetColumns.COMPANY_DOMAIN.value,
+    SheetColumns.COMPANY_SIZE.value,
+    SheetColumns.INDUSTRY.value,
+    SheetColumns.COMPANY_BACKGROUND.value,
+)
+
+_encodings = {}
+
+
+def _encoding(model: str):
+    if tiktoken is None:
+        return None
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encodings[model] = tiktoken.get_encoding("cl100k_base")
+    return _encodings[model]
+
+
+def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
+    if encoding := _encoding(model):
+        return len(encoding.encode(text))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def count_message_tokens(messages: list[dict], model: str = "gpt-3.5-turbo") -> int:
+    """Prompt tokens of a chat request"""
+    return sum(count_tokens(message['content'], model) + MESSAGE_OVERHEAD for message in messages) + 2
+
+
+def truncate_tokens(text: str, budget: int, model: str = "gpt-3.5-turbo", keep_end: bool = False) -> str:
+    """``text`` cut to at most ``budget`` tokens, keeping its start (or its end with ``keep_end``)"""
+    if count_tokens(text, model) <= budget:
+        return text
+    if encoding := _encoding(model):
+        tokens = encoding.encode(text)
+        return encoding.decode(tokens[-budget:] if keep_end else tokens[:budget])
+    chars = budget * CHARS_PER_TOKEN
+    return text[-chars:] if keep_end else text[:chars]
+
+
+def trim_history(conversation: dict | str, budget: int, model: str = "gpt-3.5-turbo") -> dict | str:
+    """The newest part of a conversation that fits in ``budget`` tokens
+
+    A conversation dict (timestamp -> {"sender", "message"}) keeps whole
+    messages, newest first, returned in chronological order; the newest message
+    alone is truncated if it is over budget. Text keeps its end.
+    """
+    if not isinstance(conversation, dict):
+        return truncate_tokens(str(conversation), budget, model, keep_end=True)
+
+    kept, used = [], 0
+    for timestamp in sorted(conversation, reverse=True):
+        entry = conversation[timestamp]
+        cost = count_tokens(f"{timestamp} {entry}", model)
+        if used + cost > budget:
+            if not kept:
+                message = truncate_tokens(str(entry.get('message', '')), budget, model, keep_end=True)
+                kept.append((timestamp, {**entry, 'message': message}))
+            break
+        kept.append((timestamp, entry))
+        used += cost
+    return dict(reversed(kept))
+
+
+def lead_prompt_info(lead: dict, budget: int, model: str = "gpt-3.5-turbo") -> dict:
+    """The lead's descriptive fields, with the company background trimmed to fit ``budget``"""
+    info = {field: lead[field] for field in LEAD_PROMPT_FIELDS if lead.get(field)}
+    background = SheetColumns.COMPANY_BACKGROUND.value
+    if background in info:
+        rest = count_tokens(str({k: v for k, v in info.items() if k != background}), model)
+        info[background] = truncate_tokens(str(info[background]), max(budget - rest, 0), model)
+    return info
@@ -0,0 +1,36 @@
+import time
+import threading
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing ``rate`` acquisitions per ``per`` seconds"""
+
+    def __init__(self, rate: float, per: float = 60.0, capacity: float | None = None):
+        self.rate = rate
+        self.per = per
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate / self.per)
+        self._updated_at = now
+
+    def acquire(self, tokens: float = 1, timeout: float | None = None) -> bool:
+        """Block until ``tokens`` are available; False if ``timeout`` runs out first"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) * self.per / self.rate
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
@@ -1,71 +1,299 @@
+import os
+import time
+import random
+import threading
+from contextlib import contextmanager
 from flask_apscheduler import APScheduler
-from connectors.email_monitor import EmailMonitor
+from apscheduler.jobstores.base import JobLookupError
+from apscheduler.schedulers.background import BackgroundScheduler
 from config import Config
-from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
-
-scheduler = APScheduler()
-
-def check_single_email(config):
-    """Check replies for a single email configuration"""
-    email_config = {
-        "email": config["email"],
-        "password": config["password"],
-        "imap_server": "mail.privateemail.com",
-        "imap_port": 993
-    }
-    
-    try:
-        monitor = EmailMonitor(email_config)
-        monitor.check_replies()
-        print(f"Successfully checked {config['email']}")
-        return True
-    except Exception as e:
-        print(f"Error checking {config['email']}: {e}")
-        return False
-
-def check_email_replies():
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from connectors.repository import queue_sheet_update
+
+try:
+    import fcntl
+except ImportError:  # Windows; overlap protection is then per process only
+    fcntl = None
+
+scheduler = APScheduler(scheduler=BackgroundScheduler(daemon=True))
+
+# Shared by every run, so a mailbox still running past its timeout doesn't hold up the next run
+MONITOR_EXECUTOR = ThreadPoolExecutor(max_workers=Config.MONITOR_MAX_WORKERS, thread_name_prefix="mailbox-check")
+
+
+@contextmanager
+def mailbox_lock(mailbox: str, lock_dir: str | None = Config.MONITOR_LOCK_DIR):
+    """Hold the cross-process lock for ``mailbox``, yielding False if another check holds it"""
+    if fcntl is None or not lock_dir:
+        yield True
+        return
+    os.makedirs(lock_dir, exist_ok=True)
+    with open(os.path.join(lock_dir, f"{mailbox}.lock"), 'w') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def check_single_email(monitor, leads, lock_dir: str | None = Config.MONITOR_LOCK_DIR) -> tuple[dict | None, Exception | None]:
+    """Check replies for a single mailbox while holding its lock
+
+    Returns its updates and the error that stopped it, if any. Updates are
+    None if another poll or worker process is already checking the mailbox.
+    """
+    with mailbox_lock(monitor.config['email'], lock_dir) as acquired:
+        if not acquired:
+            print(f"Skipped {monitor.config['email']}, another check is running")
+            return None, None
+        updates = {}
+        try:
+            monitor.collect_replies(leads, updates)
+            print(f"Successfully checked {monitor.config['email']}")
+            return updates, None
+        except Exception as e:
+            print(f"Error checking {monitor.config['email']}: {e}")
+            return updates, e
+
+
+def queue_reply_updates(updates: dict[str, dict]):
+    """Hand replies to the sheet write queue, which coalesces and rate limits them with every other write"""
+    for lead_email, data in updates.items():
+        queue_sheet_update(lead_email, data)
+
+
+def check_email_replies(monitors, leads, timeout: float = Config.MONITOR_TIMEOUT, lock_dir: str | None = Config.MONITOR_LOCK_DIR) -> dict:
+    """Check every mailbox in parallel and queue all replies found for the sheet
+
+    Every mailbox has ``timeout`` seconds from when the run is submitted, so
+    time spent waiting for a free worker counts too. Checks that haven't
+    started by then are cancelled. One already running can't be interrupted:
+    it keeps going, still holding its mailbox lock, and queues its own replies
+    when it finishes, as its checkpoint will already have moved past them. A
+    mailbox that fails still contributes the replies found before the error.
+    Returns which mailboxes were checked, failed, timed out or skipped because
+    another check holds them, and which leads were updated.
+    """
     print(f"Starting parallel email checks at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    
-    # Use ThreadPoolExecutor to run checks in parallel
-    with ThreadPoolExecutor(max_workers=len(Config.SENDER_CONFIGS)) as executor:
-        # Submit all tasks
-        future_to_email = {
-            executor.submit(check_single_email, config): config["email"] 
-            for config in Config.SENDER_CONFIGS
+    deadline = time.monotonic() + timeout
+    futures = {
+        MONITOR_EXECUTOR.submit(check_single_email, monitor, leads, lock_dir): monitor.config['email']
+        for monitor in monitors
+    }
+
+    report = {'checked': [], 'failed': {}, 'timed_out': [], 'skipped': []}
+    updates = {}
+    pending = set(futures)
+    while pending and (remaining := deadline - time.monotonic()) > 0:
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        for future in done:
+            mailbox_updates, error = future.result()
+            if mailbox_updates is None:
+                report['skipped'].append(futures[future])
+                continue
+            updates.update(mailbox_updates)
+            if error is None:
+                report['checked'].append(futures[future])
+            else:
+                report['failed'][futures[future]] = str(error)
+
+    for future in pending:
+        print(f"Timed out checking {futures[future]}")
+        report['timed_out'].append(futures[future])
+        if not future.cancel():
+            future.add_done_callback(lambda late: queue_reply_updates(late.result()[0] or {}))
+
+    queue_reply_updates(updates)
+    report['updated'] = sorted(updates)
+    print("Completed all parallel email checks")
+    return report
+
+
+class _MailboxPoll:
+    """Schedule and timings of one mailbox's polls"""
+
+    def __init__(self, monitor, interval: float):
+        self.monitor = monitor
+        self.interval = interval
+        self.next_run = None
+        self.running = False
+        self.rerun = False
+        self.last_started = None
+        self.last_duration = None
+        self.last_lag = None
+        self.last_replies = 0
+        self.last_activity = None
+        self.runs = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.skipped = 0
+
+    def stats(self) -> dict:
+        return {
+            'email': self.monitor.config['email'],
+            'interval': round(self.interval, 1),
+            'next_run': self.next_run.isoformat() if self.next_run else None,
+            'running': self.running,
+            'last_started': self.last_started.isoformat() if self.last_started else None,
+            'last_duration': self.last_duration,
+            'last_lag': self.last_lag,
+            'last_replies': self.last_replies,
+            'last_activity': self.last_activity.isoformat() if self.last_activity else None,
+            'runs': self.runs,
+            'failures': self.failures,
+            'timeouts': self.timeouts,
+            'skipped_overlaps': self.skipped,
         }
-        
-        # Process results as they complete
-        for future in as_completed(future_to_email):
-            email = future_to_email[future]
-            try:
-                success = future.result()
-                if success:
-                    print(f"Completed check for {email}")
+
+
+class AdaptivePoller:
+    """Polls each mailbox on its own schedule, adapted to its recent reply activity.
+
+    A mailbox that just received replies (or an IDLE push) is polled every
+    ``min_interval`` seconds; each poll that finds nothing multiplies its
+    interval by ``backoff``, up to ``max_interval``. Every delay is spread by
+    +/- ``jitter`` so mailboxes don't poll in lockstep, and a per-mailbox file
+    lock in ``lock_dir`` stops other worker processes from polling the same
+    mailbox at the same time.
+    """
+
+    def __init__(self, scheduler: APScheduler, min_interval: float, max_interval: float,
+                 backoff: float = 2.0, jitter: float = 0.2, lock_dir: str | None = None):
+        self.scheduler = scheduler
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.lock_dir = lock_dir
+        self.load_leads = None
+        self._lock = threading.Lock()
+        self._polls = {}
+
+    def _job_id(self, mailbox: str) -> str:
+        return f"check_email_replies:{mailbox}"
+
+    def _schedule(self, poll: _MailboxPoll, delay: float) -> None:
+        delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        poll.next_run = datetime.now() + timedelta(seconds=max(delay, 0))
+        self.scheduler.add_job(
+            id=self._job_id(poll.monitor.config['email']),
+            func=self._run,
+            args=[poll.monitor.config['email']],
+            trigger='date',
+            run_date=poll.next_run,
+            misfire_grace_time=None,  # A late poll still runs
+            replace_existing=True
+        )
+
+    def sync(self, monitors) -> None:
+        """Poll exactly these monitors, keeping the state of mailboxes already polled"""
+        with self._lock:
+            wanted = {monitor.config['email']: monitor for monitor in monitors}
+            for mailbox in set(self._polls) - set(wanted):
+                del self._polls[mailbox]
+                try:
+                    self.scheduler.remove_job(self._job_id(mailbox))
+                except JobLookupError:
+                    pass
+            for mailbox, monitor in wanted.items():
+                if mailbox in self._polls:
+                    self._polls[mailbox].monitor = monitor
+                    continue
+                poll = self._polls[mailbox] = _MailboxPoll(monitor, self.min_interval)
+                # Spread the first polls over one interval
+                self._schedule(poll, random.uniform(0, self.min_interval))
+
+    def poll_now(self, mailbox: str) -> bool:
+        """Poll a mailbox as soon as possible, e.g. when IDLE reports new mail; False if it isn't polled here"""
+        with self._lock:
+            poll = self._polls.get(mailbox)
+            if poll is None:
+                return False
+            poll.interval = self.min_interval
+            if poll.running:
+                poll.rerun = True
+            else:
+                poll.next_run = datetime.now()
+                self.scheduler.add_job(
+                    id=self._job_id(mailbox), func=self._run, args=[mailbox],
+                    trigger='date', run_date=poll.next_run, misfire_grace_time=None, replace_existing=True
+                )
+            return True
+
+    def _run(self, mailbox: str) -> None:
+        with self._lock:
+            poll = self._polls.get(mailbox)
+            if poll is None or poll.running:
+                return
+            poll.running = True
+            poll.last_started = datetime.now()
+            poll.last_lag = round((poll.last_started - poll.next_run).total_seconds(), 3) if poll.next_run else None
+
+        replies = 0
+        started = time.monotonic()
+        try:
+            report = check_email_replies([poll.monitor], self.load_leads(), lock_dir=self.lock_dir)
+            if report['skipped']:
+                poll.skipped += 1
+                return
+            replies = len(report['updated'])
+            poll.runs += 1
+            poll.failures += len(report['failed'])
+            poll.timeouts += len(report['timed_out'])
+        except Exception as e:
+            print(f"Scheduled check failed for {mailbox}: {e}")
+            poll.failures += 1
+        finally:
+            with self._lock:
+                poll.running = False
+                poll.last_duration = round(time.monotonic() - started, 3)
+                poll.last_replies = replies
+                if replies:
+                    poll.last_activity = datetime.now()
+                    poll.interval = self.min_interval
                 else:
-                    print(f"Failed to check {email}")
-            except Exception as e:
-                print(f"Exception checking {email}: {e}")
-    
-    print("Completed all parallel email checks")
+                    poll.interval = min(poll.interval * self.backoff, self.max_interval)
+                if mailbox in self._polls:
+                    self._schedule(poll, 0 if poll.rerun else poll.interval)
+                poll.rerun = False
+
+    def stats(self) -> dict:
+        """Per-mailbox timings plus the backlog of polls that are due but haven't started"""
+        now = datetime.now()
+        with self._lock:
+            jobs = [poll.stats() for poll in self._polls.values()]
+            overdue = sum(1 for poll in self._polls.values() if not poll.running and poll.next_run and poll.next_run <= now)
+        return {
+            'jobs': sorted(jobs, key=lambda job: job['next_run'] or ''),
+            'running': sum(1 for job in jobs if job['running']),
+            'backlog': overdue,
+        }
+
+
+POLLER = AdaptivePoller(
+    scheduler,
+    min_interval=Config.MONITOR_MIN_INTERVAL,
+    max_interval=Config.MONITOR_MAX_INTERVAL,
+    jitter=Config.MONITOR_JITTER,
+    lock_dir=Config.MONITOR_LOCK_DIR,
+)
+
 
+def init_scheduler(app, monitors, load_leads) -> AdaptivePoller:
+    """Poll every monitor's mailbox on its adaptive schedule alongside the app
 
-def x():
-    # Configure scheduler
-    scheduler = APScheduler(scheduler=BackgroundScheduler(daemon=True))
+    ``load_leads`` returns the leads to match replies against on each poll.
+    """
     scheduler.init_app(app)
+    POLLER.load_leads = load_leads
+    POLLER.sync(monitors)
 
-    # Add the job to check emails every minute
-    scheduler.add_job(
-        id='check_email_replies',
-        func=check_email_replies,
-        trigger='interval',
-        minutes=1,
-        max_instances=1,  # Only one instance can run at a time
-        replace_existing=True  # Replace any existing job with same ID
-    )
-
-    # Start the scheduler with the app
     with app.app_context():
         if not scheduler.running:
-            scheduler.start()
\ No newline at end of file
+            scheduler.start()
+    return POLLER
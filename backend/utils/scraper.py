@@ -1,71 +1,359 @@
-import requests
+import time
+import queue
+import asyncio
+import sqlite3
+import weakref
+import threading
+from urllib.parse import urlparse
+import httpx
 from bs4 import BeautifulSoup
+from config import Config
+from utils.metrics import METRICS
 
-def get_company_description(domain: str) -> str:
-    if not is_valid_url(domain):
-        domain = f"https://{domain}"
-    
-    content = []
-    visited_urls = set()
-    
-    def extract_content(url: str) -> None:
-        if url in visited_urls:
+# Link texts that point to pages describing the company
+ABOUT_TERMS = ['about', 'company', 'who we are']
+# Words after which no further about pages are visited, and the length of a description
+ENOUGH_WORDS = 200
+MAX_WORDS = 1000
+
+PAGE_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT PRIMARY KEY,
+    domain TEXT NOT NULL,
+    body TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    size INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_used_at ON pages (used_at);
+"""
+
+
+class PageCache:
+    """Scraped pages kept in SQLite with their validators, so a refetch can be a conditional GET.
+
+    A page is served as is for ``ttl`` seconds after it was fetched or
+    revalidated; after that it is requested again with ``If-None-Match`` /
+    ``If-Modified-Since`` and a 304 reuses the stored body, as does a failed
+    request, so a site that is down doesn't lose its page. The least recently
+    used pages are evicted once they total more than ``max_bytes``.
+    """
+
+    def __init__(self, path: str, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(PAGE_CACHE_SCHEMA)
+
+    def get(self, url: str) -> dict | None:
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT body, etag, last_modified, fetched_at FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE pages SET used_at = ? WHERE url = ?", (time.time(), url))
+        body, etag, last_modified, fetched_at = row
+        return {'body': body, 'etag': etag, 'last_modified': last_modified, 'fresh': time.time() - fetched_at < self.ttl}
+
+    def put(self, url: str, domain: str, body: str, etag: str | None, last_modified: str | None) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages (url, domain, body, etag, last_modified, size, fetched_at, used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, domain, body, etag, last_modified, len(body.encode()), now, now)
+            )
+            self._evict()
+
+    def revalidated(self, url: str) -> None:
+        """The server confirmed the stored page is current"""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE pages SET fetched_at = ? WHERE url = ?", (time.time(), url))
+
+    def _evict(self) -> None:
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
             return
-        visited_urls.add(url)
-        
-        response = requests.get(url, timeout=5)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Get meta description
-        meta_desc = soup.find('meta', attrs={'name': 'description'})
-        if meta_desc and meta_desc.get('content'):
-            content.append(meta_desc.get('content').strip())
-        
-        # Find relevant links
-        about_links = []
-        for link in soup.find_all('a', href=True):
-            href = link.get('href')
-            text = link.text.lower().strip()
-            if any(term in text for term in ['about', 'company', 'who we are']):
-                if href.startswith('/'):
-                    href = f"{domain.rstrip('/')}{href}"
-                elif not href.startswith('http'):
-                    continue
-                about_links.append(href)
-        
-        # Extract main content
-        main_content = []
-        for elem in soup.find_all(['h1', 'h2', 'h3', 'p']):
-            if elem.text.strip():
-                main_content.append(elem.text.strip())
-        
-        content.extend(main_content[:15])  # Limit main content
-        
-        # Visit about pages
-        for link in about_links[:2]:  # Limit to first 2 about links
-            if len(' '.join(content).split()) < 200:  # Check word count
-                extract_content(link)
-    
-    extract_content(domain)
-    
-    # Combine and trim to 200 words
+        evict = []
+        for url, size in self._conn.execute("SELECT url, size FROM pages ORDER BY used_at"):
+            if total <= self.max_bytes:
+                break
+            evict.append((url,))
+            total -= size
+        self._conn.executemany("DELETE FROM pages WHERE url = ?", evict)
+        METRICS.incr('scrape_cache.evicted', len(evict))
+
+    def stats(self) -> dict:
+        with self._lock:
+            pages, domains, size = self._conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT domain), COALESCE(SUM(size), 0) FROM pages"
+            ).fetchone()
+        return {
+            'pages': pages,
+            'domains': domains,
+            'bytes': size,
+            'hits': METRICS.get('scrape_cache.hit'),
+            'revalidated': METRICS.get('scrape_cache.revalidated'),
+            'stale': METRICS.get('scrape_cache.stale'),
+            'misses': METRICS.get('scrape_cache.miss'),
+        }
+
+
+PAGE_CACHE = PageCache(Config.SCRAPER_CACHE_DB, max_bytes=Config.SCRAPER_CACHE_MAX_BYTES, ttl=Config.SCRAPER_CACHE_TTL)
+
+
+def _parse_page(html: str, domain: str) -> tuple[list[str], list[str]]:
+    """The meta description and main text of a page, and the about links worth visiting next"""
+    soup = BeautifulSoup(html, 'html.parser')
+    content = []
+
+    # Get meta description
+    meta_desc = soup.find('meta', attrs={'name': 'description'})
+    if meta_desc and meta_desc.get('content'):
+        content.append(meta_desc.get('content').strip())
+
+    # Find relevant links
+    about_links = []
+    for link in soup.find_all('a', href=True):
+        href = link.get('href')
+        text = link.text.lower().strip()
+        if any(term in text for term in ABOUT_TERMS):
+            if href.startswith('/'):
+                href = f"{domain.rstrip('/')}{href}"
+            elif not href.startswith('http'):
+                continue
+            about_links.append(href)
+
+    # Extract main content
+    main_content = []
+    for elem in soup.find_all(['h1', 'h2', 'h3', 'p']):
+        if elem.text.strip():
+            main_content.append(elem.text.strip())
+
+    content.extend(main_content[:15])  # Limit main content
+    return content, about_links[:2]  # Limit to first 2 about links
+
+
+def _word_count(content: list[str]) -> int:
+    return len(' '.join(content).split())
+
+
+def _join(content: list[str]) -> str:
     final_text = ' '.join(content)
     words = final_text.split()
-    if len(words) > 1000:
-        final_text = ' '.join(words[:1000]) + '...'
-    
-    print(visited_urls)
+    if len(words) > MAX_WORDS:
+        final_text = ' '.join(words[:MAX_WORDS]) + '...'
     return final_text
 
 
+class CompanyScraper:
+    """Describes companies from their websites, many domains at a time, over one pooled HTTP client.
+
+    Use as ``async with CompanyScraper() as scraper``. At most
+    ``max_connections`` requests are in flight overall and ``per_host`` to any
+    one host. A domain gets ``deadline`` seconds from when its first page is
+    requested; by then whatever text was gathered is its description.
+    Pages come from PAGE_CACHE when enabled; ``use_cache=False`` downloads
+    every page again and stores the fresh copies. Responses other than 2xx
+    (or a 304 for a cached page) count as failed fetches.
+    """
+
+    def __init__(self, max_connections: int = Config.SCRAPER_MAX_CONNECTIONS, per_host: int = Config.SCRAPER_PER_HOST,
+                 timeout: float = Config.SCRAPER_TIMEOUT, deadline: float = Config.SCRAPER_DOMAIN_DEADLINE,
+                 use_cache: bool = True):
+        self.max_connections = max_connections
+        self.per_host = per_host
+        self.timeout = timeout
+        self.deadline = deadline
+        self.use_cache = use_cache
+        self._client = None
+
+    async def __aenter__(self):
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+            # Waiting for a free connection is bounded by the domain deadline instead
+            timeout=httpx.Timeout(self.timeout, pool=None),
+            follow_redirects=True,
+        )
+        self._requests = asyncio.Semaphore(self.max_connections)
+        # Domains started at once; the rest wait, so their deadline doesn't run out in the queue
+        self._domains = asyncio.Semaphore(self.max_connections)
+        self._hosts = {}
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._client.aclose()
+
+    async def _fetch(self, url: str, domain: str, use_cache: bool) -> str:
+        # SQLite calls run on worker threads, so they never hold up the other fetches on the loop
+        consulted = use_cache and Config.SCRAPER_CACHE
+        cached = await asyncio.to_thread(PAGE_CACHE.get, url) if consulted else None
+        if cached and cached['fresh']:
+            METRICS.incr('scrape_cache.hit')
+            return cached['body']
+
+        headers = {}
+        if cached and cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached and cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+
+        host = urlparse(url).netloc.lower()
+        if host not in self._hosts:
+            self._hosts[host] = asyncio.Semaphore(self.per_host)
+        try:
+            async with self._hosts[host], self._requests:
+                response = await self._client.get(url, headers=headers)
+        except httpx.HTTPError:
+            if not cached:
+                raise
+            response = None
+
+        if cached and response is not None and response.status_code == 304:
+            METRICS.incr('scrape_cache.revalidated')
+            await asyncio.to_thread(PAGE_CACHE.revalidated, url)
+            return cached['body']
+        if response is None or not response.is_success:
+            if cached:
+                # A stale copy beats no description while the site is failing
+                METRICS.incr('scrape_cache.stale')
+                return cached['body']
+            raise httpx.HTTPStatusError(f"{response.status_code} fetching {url}", request=response.request, response=response)
+        if consulted:
+            METRICS.incr('scrape_cache.miss')
+        if Config.SCRAPER_CACHE and response.status_code == 200:
+            await asyncio.to_thread(
+                PAGE_CACHE.put, url, domain, response.text, response.headers.get('etag'), response.headers.get('last-modified'))
+        return response.text
+
+    async def _crawl(self, domain: str, content: list[str], use_cache: bool) -> None:
+        """Fill ``content`` from the home page, then its about pages a level at a time until there is enough"""
+        visited = set()
+        level = [domain]
+        while level and _word_count(content) < ENOUGH_WORDS:
+            visited.update(level)
+            pages = await asyncio.gather(*(self._fetch(url, domain, use_cache) for url in level), return_exceptions=True)
+            next_level = []
+            for url, page in zip(level, pages):
+                if isinstance(page, Exception):
+                    if url == domain:
+                        raise page
+                    continue
+                page_content, about_links = _parse_page(page, domain)
+                content.extend(page_content)
+                next_level.extend(link for link in about_links if link not in visited and link not in next_level)
+            level = next_level
+
+    async def describe(self, domain: str, use_cache: bool | None = None) -> str:
+        """Description of one domain; ``use_cache`` overrides the scraper's setting for this call"""
+        if not is_valid_url(domain):
+            domain = f"https://{domain}"
+        content = []
+        async with self._domains:
+            try:
+                use_cache = self.use_cache if use_cache is None else use_cache
+                await asyncio.wait_for(self._crawl(domain, content, use_cache), self.deadline)
+            except asyncio.TimeoutError:
+                if not content:
+                    raise
+        return _join(content)
+
+    async def describe_all(self, domains: list[str]):
+        """Yield (domain, description, error) for every domain, in the order they finish"""
+        async def describe(domain: str) -> tuple[str, str | None, Exception | None]:
+            try:
+                return domain, await self.describe(domain), None
+            except Exception as e:
+                return domain, None, e
+
+        tasks = [asyncio.create_task(describe(domain)) for domain in dict.fromkeys(domains)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+# One scraper per event loop, so single-domain lookups share its client and connection limits
+_scrapers = weakref.WeakKeyDictionary()
+_scraper_loop = None
+_scraper_loop_lock = threading.Lock()
+
+
+async def shared_scraper() -> CompanyScraper:
+    """The running event loop's CompanyScraper, opened on first use and kept for the loop's lifetime"""
+    loop = asyncio.get_running_loop()
+    if (scraper := _scrapers.get(loop)) is None:
+        scraper = _scrapers[loop] = CompanyScraper()
+        await scraper.__aenter__()
+    return scraper
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    """Event loop that runs synchronous callers' lookups, so they reuse one scraper too"""
+    global _scraper_loop
+    with _scraper_loop_lock:
+        if _scraper_loop is None:
+            _scraper_loop = asyncio.new_event_loop()
+            threading.Thread(target=_scraper_loop.run_forever, name="company-scraper-loop", daemon=True).start()
+        return _scraper_loop
+
+
+async def get_company_description_async(domain: str, use_cache: bool = True) -> str:
+    scraper = await shared_scraper()
+    return await scraper.describe(domain, use_cache)
+
+
+def get_company_description(domain: str, use_cache: bool = True) -> str:
+    return asyncio.run_coroutine_threadsafe(get_company_description_async(domain, use_cache), _background_loop()).result()
+
+
+def iter_company_descriptions(domains: list[str], **options):
+    """CompanyScraper.describe_all for synchronous callers, scraping on a thread of its own"""
+    results = queue.Queue()
+    finished = object()
+    stopped = threading.Event()
+
+    async def scrape():
+        async with CompanyScraper(**options) as scraper:
+            async for result in scraper.describe_all(domains):
+                if stopped.is_set():
+                    break
+                results.put(result)
+
+    def run():
+        try:
+            asyncio.run(scrape())
+        except Exception as e:
+            results.put(e)
+        finally:
+            results.put(finished)
+
+    threading.Thread(target=run, name="company-scraper", daemon=True).start()
+    try:
+        while (result := results.get()) is not finished:
+            if isinstance(result, Exception):
+                raise result
+            yield result
+    finally:
+        stopped.set()
+
+
 def is_valid_url(url: str) -> bool:
     # Validates URL
     if not url:
         return False
-        
+
     try:
         from urllib.parse import urlparse
         result = urlparse(url)
         return all([result.scheme, result.netloc])
     except:
-        return False
\ No newline at end of file
+        return False